@@ -1,76 +1,293 @@
 import asyncio
-from datetime import datetime
+import inspect
+from datetime import date
 from aiogram import BaseMiddleware, Bot, Dispatcher
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery, User, BufferedInputFile
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from pydantic import BaseModel
-from config import TELEGRAM_BOT_TOKEN
-from utils.api_requests import get_food_info, get_weather_async
-from utils.calculation import calculate_calories, calculate_water
-from utils.visualization import get_water_visualization
+from config import (
+    check_tokens,
+    TELEGRAM_BOT_TOKEN,
+    USER_STORAGE,
+    USER_DB_PATH,
+    USER_CACHE_SIZE,
+    USER_FLUSH_INTERVAL,
+    USER_FLUSH_BATCH,
+    FSM_STORAGE,
+    FSM_DB_PATH,
+    FSM_TTL,
+    CHART_EXECUTOR,
+    CHART_WORKERS,
+    CHART_QUEUE_SIZE,
+    CHART_FAST_MODE,
+    CHART_PRELOAD,
+    CHART_CACHE_SIZE,
+    CHART_CACHE_BYTES,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONCURRENCY,
+    WEBHOOK_MAX_PENDING,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_DRAIN_TIMEOUT,
+    SEND_GLOBAL_RATE,
+    SEND_CHAT_RATE,
+    SEND_CHAT_BURST,
+    SEND_WORKERS,
+    SEND_MAX_RETRIES,
+    HISTORY_PATH,
+    HISTORY_RETENTION_DAYS,
+    HISTORY_SNAPSHOT_INTERVAL,
+    REMINDERS_ENABLED,
+    REMINDER_HOURS,
+    DIGEST_HOUR,
+    TELEGRAM_API_URL,
+    METRICS_HOST,
+    METRICS_PORT,
+    LOG_MESSAGE_SAMPLE_RATE
+)
+from utils.api_requests import (
+    ApiError,
+    CityNotFoundError,
+    get_food_info,
+    get_weather_async,
+    start_session,
+    close_session,
+    load_caches,
+    save_caches,
+    get_cache_stats,
+    get_city_utc_offset
+)
+from utils.calculation import calculate_calories, calculate_water, update_city_goals
+from utils.visualization import ChartRenderer, RendererBusy, chart_key
+from utils.scheduler import BackgroundJobs
+from utils.storage import create_user_storage
+from utils.fsm_storage import SQLiteFSMStorage, create_fsm_storage
+from utils.cache import LRUCache
+from utils.sender import OutboundSender
+from utils.reminders import ReminderScheduler
+from utils.history import HistoryStore, WATER, FOOD, WORKOUT, EPOCH_ORDINAL
+from utils.profiles import UserProfile
+from utils.metrics import registry, start_metrics_server
+from utils.logs import Sampler, dropped_records
+import time
 import logging
 
 
-# Профиль пользователя для хранения данных
-class UserProfile(BaseModel):
-    id: int
-    weight: float
-    height: float
-    age: int
-    activity: int
-    city: str
-    water_goal: int
-    calorie_goal: int
-    logged_water: int
-    logged_calories: int
-    burned_calories: int
-    logged_activity: int
-    temperature: float
-    last_active_date: str
+# Хранилище пользователей
+users = create_user_storage(
+    USER_STORAGE,
+    UserProfile,
+    USER_DB_PATH,
+    USER_CACHE_SIZE,
+    USER_FLUSH_INTERVAL,
+    USER_FLUSH_BATCH
+)
 
+# Создаем экземпляры бота и диспетчера
+# Свой адрес Bot API (локальный сервер или заглушка для тестов)
+bot_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+check_tokens()
+bot = Bot(token=TELEGRAM_BOT_TOKEN, session=bot_session)
+# Состояния диалогов переживают перезапуск бота
+fsm_storage = create_fsm_storage(
+    FSM_STORAGE,
+    FSM_DB_PATH,
+    FSM_TTL,
+    USER_CACHE_SIZE,
+    USER_FLUSH_INTERVAL,
+    USER_FLUSH_BATCH
+)
+dp = Dispatcher(storage=fsm_storage)
+# Фоновые задачи (ежедневный сброс)
+background_jobs = BackgroundJobs()
+# HTTP-сервер метрик
+metrics_runner = None
+# Пул для рендера графиков и кэш готовых PNG
+chart_renderer = ChartRenderer(
+    CHART_WORKERS,
+    CHART_EXECUTOR,
+    CHART_QUEUE_SIZE,
+    fast=CHART_FAST_MODE,
+    cache_size=CHART_CACHE_SIZE,
+    cache_bytes=CHART_CACHE_BYTES
+)
+# file_id уже загруженных в Telegram графиков
+chart_file_ids = LRUCache(CHART_CACHE_SIZE)
+# Журнал событий и дневные сводки для /history
+history = HistoryStore(HISTORY_PATH, HISTORY_RETENTION_DAYS, USER_FLUSH_INTERVAL, HISTORY_SNAPSHOT_INTERVAL)
+# Очередь исходящих сообщений с ограничением частоты
+sender = OutboundSender(
+    bot,
+    SEND_GLOBAL_RATE,
+    SEND_CHAT_RATE,
+    SEND_CHAT_BURST,
+    SEND_WORKERS,
+    SEND_MAX_RETRIES
+)
+# Напоминания, вечерние итоги и сброс дня в местную полночь пользователей
+reminders = ReminderScheduler(
+    users,
+    sender,
+    get_city_utc_offset,
+    REMINDER_HOURS,
+    DIGEST_HOUR,
+    fetch_city=get_weather_async,
+    on_day_start=lambda stale: start_local_day(stale),
+    send_reminders=REMINDERS_ENABLED
+)
 
-# Словарь для хранения пользователей
-users = {}
 
-# Создаем экземпляры бота и диспетчера
-bot = Bot(token=TELEGRAM_BOT_TOKEN)
-dp = Dispatcher()
+# Метрики обработки обновлений
+update_duration = registry.histogram(
+    'bot_update_duration_seconds', 'Длительность обработки обновления', ('handler',)
+)
+update_errors = registry.counter(
+    'bot_update_errors_total', 'Ошибки при обработке обновлений', ('handler',)
+)
+updates_in_flight = registry.gauge(
+    'bot_updates_in_flight', 'Обновления в обработке'
+)
+registry.gauge(
+    'bot_users_in_memory', 'Профили пользователей в памяти',
+    func=lambda: users.cached_count()
+)
+registry.gauge(
+    'api_cache_stats', 'Статистика кэшей и объединения запросов к внешним API', ('cache', 'stat'),
+    func=lambda: {
+        (cache, stat): value
+        for cache, stats in get_cache_stats().items()
+        for stat, value in stats.items()
+    }
+)
+registry.gauge(
+    'sender_queue_depth', 'Сообщения в очереди на отправку', ('lane',),
+    func=lambda: {(lane, ): depth for lane, depth in sender.stats()['queue_depth'].items()}
+)
+registry.gauge(
+    'chart_render_pending', 'Графики в очереди на рендер',
+    func=lambda: chart_renderer.stats()['pending']
+)
+registry.gauge(
+    'log_records_dropped', 'Записи логов, отброшенные из-за переполнения очереди',
+    func=dropped_records
+)
+
+# Отдельный логгер для входящих сообщений с выборкой
+message_logger = logging.getLogger('bot.messages')
+message_sampler = Sampler(LOG_MESSAGE_SAMPLE_RATE)
+
+
+# Middleware для сбора метрик: время обработки по обработчикам, ошибки
+# и число обновлений в обработке
+class InstrumentationMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data: dict):
+        handler_object = data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        updates_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            update_errors.inc(name)
+            raise
+        finally:
+            update_duration.observe(time.perf_counter() - started, name)
+            updates_in_flight.dec()
 
 
 # Middleware для логирования сообщений
 class LoggingMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: Message, data: dict):
-        user = event.from_user.username
-        logging.info(f"{event.date} Сообщение от {user}: {event.text}")
+        # Выборка и проверка уровня до вызова логгера: фильтры логгера срабатывают
+        # уже после создания записи. Строка сообщения собирается в фоновом потоке
+        if message_logger.isEnabledFor(logging.INFO) and message_sampler.sample():
+            message_logger.info(
+                "Сообщение от %s: %s", event.from_user.username, event.text,
+                extra={'user_id': event.from_user.id, 'date': event.date.isoformat()}
+            )
         return await handler(event, data)
 
 
+# Обнуление дневных счетчиков пользователя
+def clear_day(user_info: UserProfile, today: int):
+    user_info.logged_activity = 0
+    user_info.logged_calories = 0
+    user_info.logged_water = 0
+    user_info.burned_calories = 0
+    user_info.last_active_day = today
+
+
+# Сброс дневной информации пользователя
+async def reset_day(user_info: UserProfile, today: int, temperature: float | None = None):
+    clear_day(user_info, today)
+    if temperature is not None:
+        user_info.temperature = temperature
+    user_info.water_goal = calculate_water(
+        user_info.weight, user_info.activity, user_info.temperature)
+    await users.save(user_info)
+
+
+# Сброс дневных счетчиков пачки профилей (день у каждого свой - местный)
+# и пересчет целей по воде, сгруппированный по городу. city_temperature -
+# новая температура городов (для остальных берется сохраненная)
+async def _recompute_batch(batch: list[tuple[UserProfile, int]], city_temperature: dict[str, float]):
+    for user_info, today in batch:
+        # Пользователь мог начать новый день раньше, чем до него дошел сброс
+        # (UpdateInfoMiddleware): его записи за сегодня не стираются
+        if today > user_info.last_active_day:
+            clear_day(user_info, today)
+    update_city_goals([user_info for user_info, _ in batch], city_temperature)
+    for user_info, _ in batch:
+        await users.save(user_info)
+
+
+# Начало нового дня для пользователей, у которых наступила местная полночь
+# (вызывается планировщиком пачками (профиль, местный день))
+async def start_local_day(stale: list[tuple[UserProfile, int]]):
+    # Температура запрашивается один раз на каждый город
+    cities = list({user_info.city for user_info, _ in stale})
+    temperatures = await asyncio.gather(
+        *(get_weather_async(city) for city in cities),
+        return_exceptions=True
+    )
+    city_temperature = {}
+    for city, temperature in zip(cities, temperatures):
+        if isinstance(temperature, Exception):
+            logging.warning("Не удалось получить погоду для %s: %s", city, temperature)
+        else:
+            city_temperature[city] = temperature
+    await _recompute_batch(stale, city_temperature)
+    logging.info("Информация за день сброшена для %d пользователей", len(stale))
+
+
 # Middleware для проверки начала нового дня
 class UpdateInfoMiddleware(BaseMiddleware):
     async def __call__(self, handler, event: Message, data: dict):
-        user_id = event.from_user.id
-        if user_id in users:
-            user_info: UserProfile = users.get(user_id)
-            last_date = user_info.last_active_date
-            now_date = datetime.now().date().isoformat()
-            # Если начался новый день, то сбросить предыдущую информацию
-            if now_date != last_date:
-                user_info.logged_activity = 0
-                user_info.logged_calories = 0
-                user_info.logged_water = 0
-                user_info.burned_calories = 0
-                temperature = await get_weather_async(user_info.city)
-                user_info.temperature = temperature
-                user_info.water_goal = calculate_water(
-                    user_info.weight, user_info.activity, temperature)
-                user_info.last_active_date = now_date
-                print(f"{event.from_user.username} Информация за день сброшена!")
+        user_info: UserProfile = await users.get(event.from_user.id)
+        if user_info is not None:
+            today = reminders.local_today(user_info.city)
+            # Если сброс в местную полночь еще не дошел до пользователя (например,
+            # бот был выключен), сбросить без запроса погоды
+            # Только вперед: пока смещение города не известно, день считается
+            # по поясу сервера и после уточнения может сдвинуться назад
+            if today > user_info.last_active_day:
+                await reset_day(user_info, today)
+                logging.info("%s Информация за день сброшена!", event.from_user.username,
+                             extra={'user_id': event.from_user.id})
         return await handler(event, data)
 
 
 # Подключение middleware к диспетчеру
+dp.message.middleware(InstrumentationMiddleware())
+dp.callback_query.middleware(InstrumentationMiddleware())
 dp.message.middleware(LoggingMiddleware())
 dp.message.middleware(UpdateInfoMiddleware())
 
@@ -90,7 +307,10 @@ async def cmd_help(message: Message):
         '/log_food <название продукта> - Записывает калорийность съеденного продукта;\n' +
         '/log_workout <тип тренировки> <время (мин)> - Фиксирует сожженные калории и расход жидкости во время тренировки;\n' +
         '/check_progress - Показывает, сколько воды и калорий потреблено, сожжено и сколько осталось до выполнения цели;\n' +
-        '/change_calorie_goal - Изменить количество калорий на день.'
+        '/change_calorie_goal - Изменить количество калорий на день;\n' +
+        '/history [7|30|365] - Итоги за последние дни;\n' +
+        '/reminders on|off - Включить или отключить напоминания и вечерние итоги;\n' +
+        '/quiet_hours <с> <до> - Часы, когда напоминания не отправляются (например, /quiet_hours 22 8).'
     )
 
 
@@ -182,7 +402,7 @@ async def cmd_set_profile_activity(message: Message, state: FSMContext):
 # Сообщение об обновлении целей с их выводом
 async def show_update_message(user_info: User, calorie_goal: int, water_goal: int, temp: int):
     more_water_info = '\nСегодня жарко, выпейте побольше воды!' if temp > 25 else ''
-    await bot.send_message(
+    await sender.send_message(
         user_info.id,
         f'@{user_info.username} Ваша информация успешно записана!\n' +
         f'Цель по калориям: {calorie_goal} калорий;\n' +
@@ -201,11 +421,22 @@ async def cmd_set_profile_city(message: Message, state: FSMContext):
     height = data.get('height')
     age = data.get('age')
     activity = data.get('activity')
-    city_temperature = await get_weather_async(city)
-    water_goal = await calculate_water(weight, activity, city_temperature)
+    weather_note = ''
+    try:
+        city_temperature = await get_weather_async(city)
+    except CityNotFoundError:
+        # Состояние сохраняется: следующее сообщение снова будет названием города
+        await message.answer("Город не найден. Проверьте название и введите его еще раз:")
+        return
+    except ApiError as e:
+        # Цель по воде без учета жары, температура обновится при ежедневном пересчете
+        logging.warning("Не удалось получить погоду для %s: %s", city, e)
+        city_temperature = 0.0
+        weather_note = "Сервис погоды сейчас недоступен, цель по воде рассчитана без учета температуры."
+    water_goal = calculate_water(weight, activity, city_temperature)
     calorie_goal = calculate_calories(weight, height, age, activity)
-    # Создание профиля пользователя
-    user_profile = UserProfile(
+    # Создание профиля пользователя (с проверкой данных)
+    user_profile = UserProfile.validate(
         id=user_id,
         weight=weight,
         height=height,
@@ -218,16 +449,19 @@ async def cmd_set_profile_city(message: Message, state: FSMContext):
         water_goal=water_goal,
         logged_water=0,
         logged_activity=0,
-        last_active_date=datetime.now().date().isoformat(),
+        last_active_date=date.fromordinal(reminders.local_today(city) + EPOCH_ORDINAL).isoformat(),
         temperature=city_temperature
     )
-    users[user_id] = user_profile
+    await users.save(user_profile)
+    reminders.track_user(user_id, city)
     await show_update_message(
         message.from_user,
         calorie_goal,
         water_goal,
         city_temperature
     )
+    if weather_note:
+        await message.answer(weather_note)
     await state.clear()
 
 # Обновление информации об активностях
@@ -241,16 +475,17 @@ def get_command_params(text: str, command: str) -> list[str]:
 # Логирование воды
 @dp.message(Command("log_water"))
 async def cmd_log_water(message: Message):
-    user_id = message.from_user.id
-    if user_id not in users:
+    user_info: UserProfile = await users.get(message.from_user.id)
+    if user_info is None:
         await message.reply("Сперва укажите данные с помощью /set_profile")
     else:
         try:
             params = get_command_params(message.text, "/log_water")
             new_water = int(params[0])
-            user_info: UserProfile = users.get(user_id)
             # Обновление данных о выпитой воде
             user_info.logged_water += new_water
+            await users.save(user_info)
+            history.record(user_info.id, WATER, new_water, offset=reminders.offset_for(user_info.city))
             water_left = user_info.water_goal - user_info.logged_water
             await message.reply(
                 "Выпитая вода записана.\n" +
@@ -264,8 +499,7 @@ async def cmd_log_water(message: Message):
 # Логирование еды. Получение информации о еде
 @dp.message(Command("log_food"))
 async def cmd_log_food(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    if user_id not in users:
+    if await users.get(message.from_user.id) is None:
         await message.reply("Сперва укажите данные с помощью /set_profile")
     else:
         try:
@@ -280,6 +514,9 @@ async def cmd_log_food(message: Message, state: FSMContext):
                 await state.set_state(FoodQuantityForm.food_quantity)
             else:
                 await message.reply("Не удалось определить продукт.")
+        except ApiError as e:
+            logging.warning("Не удалось получить информацию о продукте: %s", e)
+            await message.answer("Сервис информации о продуктах временно недоступен, попробуйте позже.")
         except Exception:
             await message.answer("Произошла ошибка при обработке запроса.")
 
@@ -287,8 +524,8 @@ async def cmd_log_food(message: Message, state: FSMContext):
 # Логирование еды. Получение информации о съеденном количестве
 @dp.message(FoodQuantityForm.food_quantity)
 async def cmd_set_profile_activity(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    if user_id not in users:
+    user_info: UserProfile = await users.get(message.from_user.id)
+    if user_info is None:
         await message.reply("Сперва укажите данные с помощью /set_profile")
     else:
         try:
@@ -296,10 +533,11 @@ async def cmd_set_profile_activity(message: Message, state: FSMContext):
             quantity = int(message.text)
             calorie = data.get('food_calorie')
             new_calories = calorie*quantity/100
-            user_info: UserProfile = users.get(user_id)
             logged_calories = user_info.logged_calories + new_calories
             # Обновление данных о калориях
             user_info.logged_calories = logged_calories
+            await users.save(user_info)
+            history.record(user_info.id, FOOD, new_calories, offset=reminders.offset_for(user_info.city))
             await message.reply(
                 f"Потребленные калории записаны : {new_calories} ккал.\n" +
                 f"Калорий за день: {user_info.logged_calories} из {user_info.calorie_goal} ккал\n" +
@@ -313,8 +551,8 @@ async def cmd_set_profile_activity(message: Message, state: FSMContext):
 # Логирование тренировок
 @dp.message(Command("log_workout"))
 async def cmd_log_workout(message: Message):
-    user_id = message.from_user.id
-    if user_id not in users:
+    user_info: UserProfile = await users.get(message.from_user.id)
+    if user_info is None:
         await message.reply("Сперва укажите данные с помощью /set_profile")
     else:
         try:
@@ -322,10 +560,13 @@ async def cmd_log_workout(message: Message):
             activity_type = params[0]
             activity_time = int(params[1])
             calories = activity_time*10
-            user_info: UserProfile = users.get(user_id)
             # Обновление сожженных калорий
             user_info.burned_calories += calories
             user_info.logged_activity += activity_time
+            await users.save(user_info)
+            history.record(
+                user_info.id, WORKOUT, activity_time, calories, offset=reminders.offset_for(user_info.city)
+            )
             optional_info = ''
             # Учет расходов воды на тренировку
             if activity_time > 30:
@@ -339,11 +580,10 @@ async def cmd_log_workout(message: Message):
 # Прогресс по воде и калориям
 @dp.message(Command("check_progress"))
 async def cmd_check_progress(message: Message):
-    user_id = message.from_user.id
-    if user_id not in users:
+    user_info: UserProfile = await users.get(message.from_user.id)
+    if user_info is None:
         await message.reply("Сперва укажите данные с помощью /set_profile")
     else:
-        user_info: UserProfile = users.get(user_id)
         logged_calories = user_info.logged_calories
         calorie_goal = user_info.calorie_goal
         await message.reply(
@@ -359,11 +599,76 @@ async def cmd_check_progress(message: Message):
         )
 
 
+# Итоги за несколько дней
+@dp.message(Command("history"))
+async def cmd_history(message: Message):
+    user_id = message.from_user.id
+    user_info: UserProfile = await users.get(user_id)
+    if user_info is None:
+        await message.reply("Сперва укажите данные с помощью /set_profile")
+        return
+    params = get_command_params(message.text, "/history")
+    days = int(params[0]) if params and params[0].isdigit() else 7
+    if days not in (7, 30, 365):
+        await message.reply("Укажите период: 7, 30 или 365 дней.")
+        return
+    # Дни истории - местные, как и дневные счетчики профиля
+    summary = await history.summary(user_id, days, reminders.local_today(user_info.city))
+    active_days = max(summary['active_days'], 1)
+    await message.reply(
+        f"Итоги за {days} дн. (дней с записями: {summary['active_days']}):\n" +
+        f"  Выпито: {summary['water']:.0f} мл, в среднем {summary['water'] / active_days:.0f} мл в день;\n" +
+        f"  Потреблено: {summary['calories']:.0f} ккал, в среднем {summary['calories'] / active_days:.0f} ккал в день;\n" +
+        f"  Потрачено: {summary['burned']:.0f} ккал;\n" +
+        f"  Активность: {summary['activity']:.0f} мин."
+    )
+
+
+# Включение и отключение напоминаний
+@dp.message(Command("reminders"))
+async def cmd_reminders(message: Message):
+    user_info: UserProfile = await users.get(message.from_user.id)
+    if user_info is None:
+        await message.reply("Сперва укажите данные с помощью /set_profile")
+        return
+    params = get_command_params(message.text, "/reminders")
+    if not params or params[0] not in ("on", "off"):
+        state = "включены" if user_info.reminders else "отключены"
+        await message.reply(f"Напоминания {state}. Используйте /reminders on или /reminders off.")
+        return
+    user_info.reminders = params[0] == "on"
+    await users.save(user_info)
+    await message.reply("Напоминания включены." if user_info.reminders else "Напоминания отключены.")
+
+
+# Тихие часы (местное время)
+@dp.message(Command("quiet_hours"))
+async def cmd_quiet_hours(message: Message):
+    user_info: UserProfile = await users.get(message.from_user.id)
+    if user_info is None:
+        await message.reply("Сперва укажите данные с помощью /set_profile")
+        return
+    params = get_command_params(message.text, "/quiet_hours")
+    try:
+        quiet_start, quiet_end = int(params[0]), int(params[1])
+        if not (0 <= quiet_start <= 23 and 0 <= quiet_end <= 23):
+            raise ValueError
+    except (IndexError, ValueError):
+        await message.reply(
+            f"Тихие часы: с {user_info.quiet_start} до {user_info.quiet_end}. " +
+            "Чтобы изменить, укажите часы от 0 до 23, например: /quiet_hours 22 8"
+        )
+        return
+    user_info.quiet_start = quiet_start
+    user_info.quiet_end = quiet_end
+    await users.save(user_info)
+    await message.reply(f"Напоминания не будут приходить с {quiet_start} до {quiet_end} часов.")
+
+
 # Изменение цели по калориям
 @dp.message(Command("change_calorie_goal"))
 async def cmd_change_calorie_goal(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    if user_id not in users:
+    if await users.get(message.from_user.id) is None:
         await message.reply("Сперва укажите данные с помощью /set_profile")
     else:
         await message.answer("Укажите новое количество калорий на день:")
@@ -373,10 +678,10 @@ async def cmd_change_calorie_goal(message: Message, state: FSMContext):
 @dp.message(UpdateInfoForm.calorie_goal)
 async def change_calorie_goal(message: Message, state: FSMContext):
     try:
-        user_id = message.from_user.id
         calorie_goal = int(message.text)
-        user_info: UserProfile = users.get(user_id)
+        user_info: UserProfile = await users.get(message.from_user.id)
         user_info.calorie_goal = calorie_goal
+        await users.save(user_info)
         await show_update_message(
             message.from_user,
             user_info.calorie_goal,
@@ -390,11 +695,11 @@ async def change_calorie_goal(message: Message, state: FSMContext):
 
 # Отправка графика с достижением целей
 async def show_goals_visualization(user_id: int):
-    if user_id not in users:
-        await bot.send_message(user_id, "Сперва укажите данные с помощью /set_profile")
+    user_info: UserProfile = await users.get(user_id)
+    if user_info is None:
+        await sender.send_message(user_id, "Сперва укажите данные с помощью /set_profile")
     else:
-        user_info: UserProfile = users.get(user_id)
-        buf = get_water_visualization(
+        values = (
             user_info.logged_water,
             user_info.water_goal,
             user_info.logged_calories,
@@ -402,10 +707,24 @@ async def show_goals_visualization(user_id: int):
             user_info.logged_activity,
             user_info.activity
         )
-        buf.seek(0)
-        photo_bytes = buf.read()
+        key = chart_key(*values)
+        # Такой график уже отправлялся - повторно используем file_id Telegram
+        file_id = chart_file_ids.get(key)
+        if file_id is not None:
+            try:
+                await sender.send_photo(user_id, file_id)
+                return
+            except TelegramBadRequest:
+                chart_file_ids.pop(key)
+        try:
+            photo_bytes = await chart_renderer.render(*values)
+        except RendererBusy:
+            await sender.send_message(user_id, "Слишком много запросов на построение графиков. Попробуйте через несколько секунд.")
+            return
         photo = BufferedInputFile(file=photo_bytes, filename='goals.png')
-        await bot.send_photo(user_id, photo=photo)
+        sent = await sender.send_photo(user_id, photo)
+        if sent.photo:
+            chart_file_ids.set(key, sent.photo[-1].file_id)
 
 
 # Обработчик вызовов из кнопок
@@ -414,20 +733,93 @@ async def handle_callback(callback_query: CallbackQuery, state: FSMContext):
     await callback_query.answer()
     if callback_query.data == "change_calorie":
         user_id = callback_query.from_user.id
-        if user_id not in users:
-            await bot.send_message(callback_query.from_user.id, "Сперва укажите данные с помощью /set_profile")
+        if await users.get(user_id) is None:
+            await sender.send_message(callback_query.from_user.id, "Сперва укажите данные с помощью /set_profile")
         else:
-            await bot.send_message(callback_query.from_user.id, "Укажите новое количество калорий на день:")
+            await sender.send_message(callback_query.from_user.id, "Укажите новое количество калорий на день:")
             await state.set_state(UpdateInfoForm.calorie_goal)
     elif callback_query.data == "show_goals":
         user_id = callback_query.from_user.id
         await show_goals_visualization(user_id)
 
 
+# Открытие общих ресурсов при старте бота
+async def on_startup():
+    global metrics_runner
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    load_caches()
+    await users.start()
+    if isinstance(fsm_storage, SQLiteFSMStorage):
+        await fsm_storage.start()
+    await history.start()
+    await start_session()
+    sender.start()
+    background_jobs.start(reminders.run())
+    # matplotlib загружается в фоне, пока бот уже принимает обновления
+    if CHART_PRELOAD:
+        chart_renderer.preload()
+    else:
+        chart_renderer.start()
+
+
+# Освобождение ресурсов при остановке бота. Шаги выполняются независимо:
+# ошибка одного (например, при сохранении кэшей) не должна помешать
+# записать профили, состояния диалогов и историю
+async def on_shutdown():
+    steps = [
+        background_jobs.stop,
+        sender.close,
+        chart_renderer.shutdown,
+        close_session,
+        save_caches,
+        users.close,
+        fsm_storage.close,
+        history.close
+    ]
+    if metrics_runner is not None:
+        steps.append(metrics_runner.cleanup)
+    for step in steps:
+        try:
+            result = step()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            logging.exception("Ошибка при остановке: %s", step.__qualname__)
+
+
+dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+
 # Основная функция запуска бота
 async def main():
     logging.info("Бот запущен!")
     await dp.start_polling(bot)
 
+
+# Запуск бота в режиме вебхука
+def main_webhook():
+    # Сервер вебхука нужен только в этом режиме
+    from utils.webhook import run_webhook
+
+    logging.info("Бот запущен в режиме вебхука!")
+    run_webhook(
+        dp,
+        bot,
+        WEBHOOK_URL,
+        WEBHOOK_PATH,
+        WEBHOOK_HOST,
+        WEBHOOK_PORT,
+        WEBHOOK_SECRET,
+        WEBHOOK_MAX_CONCURRENCY,
+        WEBHOOK_MAX_PENDING,
+        WEBHOOK_MAX_CONNECTIONS,
+        WEBHOOK_DRAIN_TIMEOUT
+    )
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    if BOT_MODE == "webhook":
+        main_webhook()
+    else:
+        asyncio.run(main())
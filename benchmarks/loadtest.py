@@ -0,0 +1,279 @@
+# Нагрузочный тест бота на локальных заглушках Telegram Bot API,
+# OpenWeatherMap и Open Food Facts.
+#
+#   python benchmarks/loadtest.py --users 200 --concurrency 50 --api-latency 0.05
+#
+# Обновления подаются напрямую в диспетчер (dp.feed_update), а все исходящие
+# запросы бота и utils/api_requests.py уходят на заглушки.
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TOKEN = '123456:LOADTEST-abcdefghijklmnopqrstuvwxyz'
+
+
+# Общие настройки заглушек: задержка и доля ошибок
+class FakeSettings:
+    def __init__(self, latency: float, error_rate: float, flood_rate: float):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.requests = defaultdict(int)
+
+
+async def _delay(settings: FakeSettings):
+    if settings.latency:
+        # Небольшой разброс, чтобы запросы не завершались строго одновременно
+        await asyncio.sleep(settings.latency * random.uniform(0.5, 1.5))
+
+
+def fake_telegram(settings: FakeSettings) -> web.Application:
+    message_ids = itertools.count(1)
+
+    async def handle(request: web.Request):
+        method = request.match_info['method']
+        settings.requests['telegram.' + method] += 1
+        await _delay(settings)
+        if random.random() < settings.flood_rate:
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1}
+            })
+        if random.random() < settings.error_rate:
+            return web.json_response({'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+        data = await request.post()
+        if method in ('sendMessage', 'sendPhoto'):
+            result = {
+                'message_id': next(message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'}
+            }
+            if method == 'sendMessage':
+                result['text'] = data.get('text', '')
+            else:
+                file_id = f"photo{result['message_id']}"
+                result['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1500, 'height': 500}]
+            return web.json_response({'ok': True, 'result': result})
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {
+                'id': 123456, 'is_bot': True, 'first_name': 'loadtest', 'username': 'loadtest_bot'
+            }})
+        return web.json_response({'ok': True, 'result': True})
+
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_post('/bot{token}/{method}', handle)
+    return app
+
+
+def fake_weather(settings: FakeSettings) -> web.Application:
+    async def geo(request: web.Request):
+        settings.requests['owm.geo'] += 1
+        await _delay(settings)
+        if random.random() < settings.error_rate:
+            return web.json_response({'cod': 500, 'message': 'error'}, status=500)
+        seed = sum(map(ord, request.query.get('q', '')))
+        return web.json_response([{'name': request.query.get('q'), 'lat': seed % 90, 'lon': seed % 180}])
+
+    async def weather(request: web.Request):
+        settings.requests['owm.weather'] += 1
+        await _delay(settings)
+        if random.random() < settings.error_rate:
+            return web.json_response({'cod': 500, 'message': 'error'}, status=500)
+        return web.json_response({'main': {'temp': 15 + float(request.query.get('lat', 0)) % 20}})
+
+    app = web.Application()
+    app.router.add_get('/geo/1.0/direct', geo)
+    app.router.add_get('/data/2.5/weather', weather)
+    return app
+
+
+def fake_food(settings: FakeSettings) -> web.Application:
+    async def search(request: web.Request):
+        settings.requests['off.search'] += 1
+        await _delay(settings)
+        if random.random() < settings.error_rate:
+            return web.json_response({'error': 'error'}, status=500)
+        name = request.query.get('search_terms', '')
+        return web.json_response({'products': [{
+            'product_name': name.capitalize(),
+            'nutriments': {'energy-kcal_100g': 50 + len(name) * 10}
+        }]})
+
+    app = web.Application()
+    app.router.add_get('/cgi/search.pl', search)
+    return app
+
+
+async def start_server(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/'
+
+
+# Конструкторы входящих обновлений
+_update_ids = itertools.count(1)
+
+
+def message_update(user_id: int, text: str) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'}
+    return {
+        'update_id': next(_update_ids),
+        'message': {
+            'message_id': next(_update_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': user,
+            'text': text
+        }
+    }
+
+
+def callback_update(user_id: int, data: str) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}', 'username': f'user{user_id}'}
+    return {
+        'update_id': next(_update_ids),
+        'callback_query': {
+            'id': str(next(_update_ids)),
+            'from': user,
+            'chat_instance': str(user_id),
+            'data': data
+        }
+    }
+
+
+CITIES = ['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Сочи']
+FOODS = ['банан', 'яблоко', 'гречка', 'творог', 'курица']
+
+
+# Сценарий одного пользователя: (метка для отчета, обновление)
+def user_script(user_id: int, rounds: int):
+    yield '/set_profile', message_update(user_id, '/set_profile')
+    yield 'profile.weight', message_update(user_id, str(random.randint(50, 110)))
+    yield 'profile.height', message_update(user_id, str(random.randint(150, 200)))
+    yield 'profile.age', message_update(user_id, str(random.randint(18, 70)))
+    yield 'profile.activity', message_update(user_id, str(random.randint(0, 120)))
+    yield 'profile.city', message_update(user_id, random.choice(CITIES))
+    for _ in range(rounds):
+        yield '/log_water', message_update(user_id, f'/log_water {random.randint(100, 500)}')
+        yield '/log_food', message_update(user_id, f'/log_food {random.choice(FOODS)}')
+        yield 'food.quantity', message_update(user_id, str(random.randint(50, 300)))
+        yield '/log_workout', message_update(user_id, f'/log_workout бег {random.randint(10, 60)}')
+        yield '/check_progress', message_update(user_id, '/check_progress')
+        yield 'show_goals', callback_update(user_id, 'show_goals')
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def peak_rss_mb() -> tuple[float, float]:
+    # ru_maxrss в Linux в килобайтах
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+async def run(args):
+    settings = FakeSettings(args.api_latency, args.error_rate, args.flood_rate)
+    telegram_settings = FakeSettings(args.telegram_latency, args.error_rate, args.flood_rate)
+    runners = []
+    telegram_runner, telegram_url = await start_server(fake_telegram(telegram_settings))
+    weather_runner, weather_url = await start_server(fake_weather(settings))
+    food_runner, food_url = await start_server(fake_food(settings))
+    runners += [telegram_runner, weather_runner, food_runner]
+
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    os.environ.update({
+        'TELEGRAM_TOKEN': TOKEN,
+        'OPEN_WEATHER_MAP_TOKEN': 'loadtest',
+        'TELEGRAM_API_URL': telegram_url,
+        'OWM_API_URL': weather_url,
+        'OFF_API_URL': food_url,
+        'USER_STORAGE': args.storage,
+        'USER_DB_PATH': os.path.join(workdir, 'users.db'),
+        'FSM_DB_PATH': os.path.join(workdir, 'fsm.db'),
+        'HISTORY_PATH': os.path.join(workdir, 'history.log'),
+        'CHART_EXECUTOR': args.chart_executor
+    })
+    import app as bot_app
+    from aiogram.types import Update
+
+    await bot_app.dp.emit_startup(bot=bot_app.bot)
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def simulate_user(user_id: int):
+        async with semaphore:
+            for label, raw in user_script(user_id, args.rounds):
+                update = Update.model_validate(raw, context={'bot': bot_app.bot})
+                started = time.perf_counter()
+                try:
+                    await bot_app.dp.feed_update(bot_app.bot, update)
+                except Exception:
+                    errors[label] += 1
+                latencies[label].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(1000 + i) for i in range(args.users)))
+    duration = time.perf_counter() - started
+
+    await bot_app.dp.emit_shutdown(bot=bot_app.bot)
+    await bot_app.bot.session.close()
+    for runner in runners:
+        await runner.cleanup()
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    print(f"Пользователей: {args.users}, обновлений: {len(all_latencies)}, время: {duration:.2f} с")
+    print(f"Пропускная способность: {len(all_latencies) / duration:.1f} обновлений/с")
+    print(f"{'команда':<18}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'ошибки':>8}")
+    errors['ВСЕГО'] = sum(errors.values())
+    for label, values in sorted(latencies.items()) + [('ВСЕГО', all_latencies)]:
+        print(
+            f"{label:<18}{len(values):>8}"
+            f"{percentile(values, 50) * 1000:>10.1f}"
+            f"{percentile(values, 95) * 1000:>10.1f}"
+            f"{percentile(values, 99) * 1000:>10.1f}"
+            f"{errors[label]:>8}"
+        )
+    own, children = peak_rss_mb()
+    print(f"Пиковый RSS: {own:.1f} МБ (процессы рендера: {children:.1f} МБ)")
+    print("Запросы к заглушкам:", dict(telegram_settings.requests), dict(settings.requests))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на локальных заглушках API")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=3, help="повторов команд на пользователя")
+    parser.add_argument('--concurrency', type=int, default=50, help="одновременно активных пользователей")
+    parser.add_argument('--api-latency', type=float, default=0.05, help="задержка погоды и еды, с")
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help="задержка Bot API, с")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов с ошибкой")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="доля ответов 429 от Bot API")
+    parser.add_argument('--storage', default='memory', choices=['memory', 'sqlite'])
+    parser.add_argument('--chart-executor', default='process', choices=['process', 'thread'])
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,107 @@
+# Сравнение представлений профиля пользователя: модель pydantic (как раньше)
+# и компактный UserProfile со слотами.
+#
+#   python benchmarks/profiles.py --users 200000 --updates 1000000
+#
+# Выводит память на пользователя (tracemalloc), скорость изменения полей
+# (как в /log_water) и скорость сериализации для хранилища.
+import argparse
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.profiles import UserProfile, UserProfileModel
+
+CITIES = ['Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Сочи']
+
+
+def profile_fields(user_id: int) -> dict:
+    return {
+        'id': user_id,
+        'weight': random.uniform(50, 110),
+        'height': random.uniform(150, 200),
+        'age': random.randint(18, 70),
+        'activity': random.randint(0, 120),
+        # Названия приходят из сообщений, то есть каждый раз новой строкой
+        'city': ''.join(random.choice(CITIES)),
+        'water_goal': random.randint(1500, 4000),
+        'calorie_goal': random.randint(1500, 3500),
+        'logged_water': 0,
+        'logged_calories': 0.0,
+        'burned_calories': 0,
+        'logged_activity': 0,
+        'temperature': random.uniform(-20, 35),
+        'last_active_date': '2026-10-18'
+    }
+
+
+def measure_memory(build, fields: list[dict]) -> tuple[list, float]:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    profiles = [build(data) for data in fields]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Без учета самого списка профилей
+    return profiles, (after - before - sys.getsizeof(profiles)) / len(fields)
+
+
+def measure_updates(profiles: list, updates: int) -> float:
+    indexes = [random.randrange(len(profiles)) for _ in range(updates)]
+    started = time.perf_counter()
+    for index in indexes:
+        profile = profiles[index]
+        profile.logged_water += 250
+        profile.logged_calories += 120.5
+    return updates / (time.perf_counter() - started)
+
+
+def measure_serialization(profiles: list, dump, load) -> float:
+    sample = profiles[:min(len(profiles), 50000)]
+    started = time.perf_counter()
+    for profile in sample:
+        load(dump(profile))
+    return len(sample) / (time.perf_counter() - started)
+
+
+def run(args):
+    random.seed(1)
+    fields = [profile_fields(1000 + i) for i in range(args.users)]
+    variants = [
+        (
+            'pydantic BaseModel',
+            lambda data: UserProfileModel(**data),
+            lambda profile: profile.model_dump_json(),
+            UserProfileModel.model_validate_json
+        ),
+        (
+            'UserProfile (слоты)',
+            lambda data: UserProfile.validate(**data),
+            lambda profile: profile.to_json(),
+            UserProfile.from_json
+        )
+    ]
+    print(f"Пользователей: {args.users}, изменений: {args.updates}")
+    print(f"{'представление':<22}{'байт/польз.':>13}{'изменений/с':>14}{'сериализаций/с':>16}")
+    for name, build, dump, load in variants:
+        profiles, bytes_per_user = measure_memory(build, fields)
+        updates_per_second = measure_updates(profiles, args.updates)
+        round_trips = measure_serialization(profiles, dump, load)
+        print(f"{name:<22}{bytes_per_user:>13.0f}{updates_per_second:>14.0f}{round_trips:>16.0f}")
+        del profiles
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Память и скорость представлений профиля пользователя")
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--updates', type=int, default=1000000)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    run(parse_args())
@@ -0,0 +1,169 @@
+# Время холодного запуска бота: импорт app.py, запуск (on_startup),
+# обработка первого обновления и первый график. Каждый запуск - отдельный
+# процесс, запросы к Bot API уходят на локальную заглушку.
+#
+#   python benchmarks/startup.py --runs 5 --budget 0.3
+#
+# Базовая линия - импорт сторонних модулей, без которых бот не запустить
+# (aiogram, pydantic, клиент aiohttp); он замеряется в том же процессе
+# перед app.py. Бюджет относится к импорту config и app.py сверх базовой
+# линии: так он не зависит от скорости машины (на эталонной машине базовая
+# линия около 3.2 с, собственный импорт около 0.17 с). Завершается с кодом 1,
+# если собственный импорт дольше бюджета или при импорте загружаются модули,
+# которые должны загружаться лениво.
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Модули, которые не должны загружаться при импорте app.py
+LAZY_MODULES = ('matplotlib', 'numpy', 'aiohttp.web')
+# Сторонние модули, которые app.py импортирует в любом случае (базовая линия)
+BASELINE_MODULES = (
+    'pydantic',
+    'aiohttp',
+    'aiogram',
+    'aiogram.types',
+    'aiogram.filters',
+    'aiogram.fsm.context',
+    'aiogram.client.session.aiohttp'
+)
+
+
+def child(launched: float, chart_after: float):
+    sys.path.insert(0, ROOT)
+    started = time.perf_counter()
+    for name in BASELINE_MODULES:
+        importlib.import_module(name)
+    baseline_loaded = time.perf_counter()
+    import config  # noqa: F401
+    config_loaded = time.perf_counter()
+    import app as bot_app
+    imported = time.perf_counter()
+    loaded_lazy = [name for name in LAZY_MODULES if name in sys.modules]
+
+    # Заглушки импортируются после замера: они загружают aiohttp.web
+    from loadtest import callback_update, message_update
+    from aiogram.types import Update
+    from utils.profiles import UserProfile
+
+    def update(raw: dict) -> Update:
+        return Update.model_validate(raw, context={'bot': bot_app.bot})
+
+    async def run() -> dict:
+        await bot_app.dp.emit_startup(bot=bot_app.bot)
+        ready = time.perf_counter()
+        await bot_app.dp.feed_update(bot_app.bot, update(message_update(1, '/start')))
+        first_update = time.time() - launched
+        await bot_app.users.save(UserProfile(
+            1, 70.0, 180.0, 30, 30, 'Москва', 2600, 2300, 500, 800.0, 100, 10, 20.0,
+            bot_app.reminders.local_today('Москва')
+        ))
+        await asyncio.sleep(chart_after)
+        chart_started = time.perf_counter()
+        await bot_app.dp.feed_update(bot_app.bot, update(callback_update(1, 'show_goals')))
+        first_chart = time.perf_counter() - chart_started
+        await bot_app.dp.emit_shutdown(bot=bot_app.bot)
+        await bot_app.bot.session.close()
+        return {
+            'import_baseline': baseline_loaded - started,
+            'import_config': config_loaded - baseline_loaded,
+            'import_app': imported - config_loaded,
+            'startup': ready - imported,
+            'first_update': first_update,
+            'first_chart': first_chart,
+            'loaded_lazy': loaded_lazy
+        }
+
+    print(json.dumps(asyncio.run(run())))
+
+
+async def run(args) -> int:
+    from loadtest import TOKEN, fake_telegram, FakeSettings, start_server
+    from config import CHART_EXECUTOR
+
+    # По умолчанию - тот же пул графиков, что и у бота
+    chart_executor = args.chart_executor or CHART_EXECUTOR
+
+    telegram_runner, telegram_url = await start_server(fake_telegram(FakeSettings(0, 0, 0)))
+    workdir = tempfile.mkdtemp(prefix='startup-')
+    env = dict(
+        os.environ,
+        TELEGRAM_TOKEN=TOKEN,
+        OPEN_WEATHER_MAP_TOKEN='startup',
+        TELEGRAM_API_URL=telegram_url,
+        USER_STORAGE='memory',
+        FSM_STORAGE='memory',
+        HISTORY_PATH='',
+        CACHE_DIR='',
+        METRICS_PORT='0',
+        LOGGING_LEVEL='30',
+        CHART_EXECUTOR=chart_executor,
+        CHART_PRELOAD='1' if args.preload else '0'
+    )
+    results = []
+    for _ in range(args.runs):
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.abspath(__file__), '--child', str(time.time()),
+            '--chart-after', str(args.chart_after),
+            env=env, cwd=workdir, stdout=asyncio.subprocess.PIPE
+        )
+        stdout, _ = await process.communicate()
+        results.append(json.loads(stdout.decode().strip().splitlines()[-1]))
+    await telegram_runner.cleanup()
+
+    print(f"Запусков: {args.runs}, пул графиков: {chart_executor}, "
+          f"предзагрузка matplotlib: {'да' if args.preload else 'нет'}")
+    labels = [
+        ('import_baseline', "импорт aiogram, pydantic, aiohttp (базовая линия)"),
+        ('import_config', "импорт config"),
+        ('import_app', "импорт app"),
+        ('startup', "on_startup"),
+        ('first_update', "до первого обновления (от запуска процесса)"),
+        ('first_chart', f"первый график (через {args.chart_after} с после старта)")
+    ]
+    for key, label in labels:
+        values = [result[key] for result in results]
+        print(f"  {label:<52}медиана {statistics.median(values) * 1000:8.1f} мс, "
+              f"макс. {max(values) * 1000:8.1f} мс")
+
+    # Собственный импорт config и app.py сверх базовой линии
+    import_own = statistics.median(result['import_config'] + result['import_app'] for result in results)
+    loaded_lazy = sorted({name for result in results for name in result['loaded_lazy']})
+    failed = False
+    if import_own > args.budget:
+        print(f"Импорт app сверх базовой линии дольше бюджета: {import_own:.2f} с > {args.budget:.2f} с")
+        failed = True
+    if loaded_lazy:
+        print("При импорте app загружены модули:", ', '.join(loaded_lazy))
+        failed = True
+    if not failed:
+        print(f"Бюджет импорта соблюден: {import_own:.2f} с <= {args.budget:.2f} с сверх базовой линии")
+    return 1 if failed else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Время холодного запуска бота")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=0.3,
+                        help="бюджет импорта config и app.py сверх базовой линии, с")
+    parser.add_argument('--chart-executor', choices=['process', 'thread'],
+                        help="пул графиков (по умолчанию CHART_EXECUTOR бота)")
+    parser.add_argument('--no-preload', dest='preload', action='store_false', help="без предзагрузки matplotlib")
+    parser.add_argument('--chart-after', type=float, default=3.0, help="пауза перед первым графиком, с")
+    parser.add_argument('--child', type=float, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.child is not None:
+        child(arguments.child, arguments.chart_after)
+    else:
+        sys.exit(asyncio.run(run(arguments)))
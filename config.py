@@ -1,9 +1,16 @@
 import os
 from dotenv import load_dotenv
 import logging
+from utils.logs import setup_logging
 
 LOGGING_LEVEL = int(os.getenv("LOGGING_LEVEL", logging.INFO))
-logging.basicConfig(level=LOGGING_LEVEL)
+# Формат логов: json (по одной JSON-строке на запись) или text
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Размер очереди записей; при переполнении новые записи отбрасываются
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Доля логируемых входящих сообщений (1 - все, 0.01 - каждое сотое в среднем)
+LOG_MESSAGE_SAMPLE_RATE = float(os.getenv("LOG_MESSAGE_SAMPLE_RATE", 1.0))
+setup_logging(LOGGING_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE)
 
 aiohttp_logger = logging.getLogger("aiohttp")
 aiohttp_logger.setLevel(LOGGING_LEVEL)
@@ -14,5 +21,128 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_TOKEN")
 OPEN_WEATHER_MAP_TOKEN = os.getenv("OPEN_WEATHER_MAP_TOKEN")
 
-if not TELEGRAM_BOT_TOKEN or not OPEN_WEATHER_MAP_TOKEN:
-    raise NameError
+
+# Проверка токенов выполняется при запуске бота, а не при импорте настроек,
+# чтобы модули можно было импортировать без них (утилиты, бенчмарки)
+def check_tokens():
+    if not TELEGRAM_BOT_TOKEN or not OPEN_WEATHER_MAP_TOKEN:
+        raise NameError
+
+# Адреса внешних API (переопределяются, например, для нагрузочного тестирования)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+OWM_API_URL = os.getenv("OWM_API_URL", "https://api.openweathermap.org/")
+OFF_API_URL = os.getenv("OFF_API_URL", "https://world.openfoodfacts.org/")
+
+# Настройки общего HTTP-клиента для внешних API
+HTTP_TOTAL_TIMEOUT = float(os.getenv("HTTP_TOTAL_TIMEOUT", 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 20))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+# Тайм-аут одной попытки запроса к OpenWeatherMap и Open Food Facts (секунды)
+OWM_TIMEOUT = float(os.getenv("OWM_TIMEOUT", 3))
+OFF_TIMEOUT = float(os.getenv("OFF_TIMEOUT", 5))
+# Общий лимит времени на запрос вместе с повторами (секунды)
+API_DEADLINE = float(os.getenv("API_DEADLINE", 8))
+# Повторы при тайм-аутах и ошибках 5xx/429 с экспоненциальной задержкой со случайным разбросом
+API_RETRIES = int(os.getenv("API_RETRIES", 2))
+API_RETRY_DELAY = float(os.getenv("API_RETRY_DELAY", 0.2))
+# После BREAKER_FAILURES ошибок подряд запросы к сервису не отправляются BREAKER_RESET секунд
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_RESET = float(os.getenv("BREAKER_RESET", 30))
+
+# Кэш геокодинга (бессрочный) и температуры (с временем жизни)
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", 10000))
+WEATHER_CACHE_SIZE = int(os.getenv("WEATHER_CACHE_SIZE", 10000))
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", 3600))
+# Сколько секунд после истечения отдавать устаревшую температуру, пока она обновляется в фоне
+WEATHER_STALE_TTL = float(os.getenv("WEATHER_STALE_TTL", 86400))
+# Кэш ответов Open Food Facts (когда нет локального индекса продуктов)
+FOOD_CACHE_SIZE = int(os.getenv("FOOD_CACHE_SIZE", 10000))
+FOOD_CACHE_TTL = float(os.getenv("FOOD_CACHE_TTL", 7 * 86400))
+FOOD_STALE_TTL = float(os.getenv("FOOD_STALE_TTL", 30 * 86400))
+# Каталог для сохранения кэшей между перезапусками (пусто - не сохранять)
+CACHE_DIR = os.getenv("CACHE_DIR", "")
+
+# Хранилище профилей пользователей: memory или sqlite
+USER_STORAGE = os.getenv("USER_STORAGE", "sqlite")
+USER_DB_PATH = os.getenv("USER_DB_PATH", "users.db")
+# Сколько профилей держать в памяти
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+# Период и размер пакета отложенной записи в базу
+USER_FLUSH_INTERVAL = float(os.getenv("USER_FLUSH_INTERVAL", 5))
+USER_FLUSH_BATCH = int(os.getenv("USER_FLUSH_BATCH", 500))
+
+# Хранилище состояний диалогов (/set_profile, /log_food): sqlite или memory
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "fsm.db")
+# Через сколько секунд без ответа незавершенный диалог сбрасывается
+FSM_TTL = int(os.getenv("FSM_TTL", 86400))
+
+# Пул для рендера графиков: process или thread
+CHART_EXECUTOR = os.getenv("CHART_EXECUTOR", "process")
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", 2))
+# Максимум графиков в работе и в очереди, остальные запросы отклоняются
+CHART_QUEUE_SIZE = int(os.getenv("CHART_QUEUE_SIZE", 16))
+# Быстрый режим рендера на заготовке графика
+CHART_FAST_MODE = os.getenv("CHART_FAST_MODE", "0") == "1"
+# Загрузка matplotlib и пробный рендер в фоне после старта бота
+# (иначе matplotlib загружается при первом запросе графика)
+CHART_PRELOAD = os.getenv("CHART_PRELOAD", "1") == "1"
+# Кэш готовых графиков: число записей и бюджет в байтах
+CHART_CACHE_SIZE = int(os.getenv("CHART_CACHE_SIZE", 1000))
+CHART_CACHE_BYTES = int(os.getenv("CHART_CACHE_BYTES", 64 * 1024 * 1024))
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес, на который Telegram будет отправлять обновления
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+# Секрет для проверки заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Число одновременно обрабатываемых обновлений и размер очереди
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", 100))
+WEBHOOK_MAX_PENDING = int(os.getenv("WEBHOOK_MAX_PENDING", 1000))
+# Число соединений, которые Telegram открывает к вебхуку (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+# Сколько ждать обработки принятых обновлений при остановке
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 30))
+
+# Ограничения частоты исходящих сообщений (в секунду)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 30))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", 1))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", 3))
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", 16))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 3))
+
+# Локальный индекс продуктов (python -m utils.food_index build ...), пусто - не использовать
+FOOD_INDEX_PATH = os.getenv("FOOD_INDEX_PATH", "")
+# Журнал продуктов, найденных через Open Food Facts (пусто - FOOD_INDEX_PATH + .new.jsonl)
+FOOD_OVERLAY_PATH = os.getenv("FOOD_OVERLAY_PATH", "")
+
+# Журнал событий пользователей (вода, еда, тренировки), пусто - только в памяти.
+# Дневные сводки хранятся в базе рядом с журналом (history.log -> history.db),
+# журнал раз в сутки переносится в архив (history.log.2026-10-17)
+HISTORY_PATH = os.getenv("HISTORY_PATH", "history.log")
+# Сколько дней хранить дневные сводки и архивы журнала
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", 400))
+# Как часто переносить сводки в базу (секунды)
+HISTORY_SNAPSHOT_INTERVAL = float(os.getenv("HISTORY_SNAPSHOT_INTERVAL", 300))
+
+# Напоминания отставшим от цели и вечерние итоги (по местному времени пользователя)
+REMINDERS_ENABLED = os.getenv("REMINDERS_ENABLED", "1") == "1"
+REMINDER_HOURS = tuple(int(hour) for hour in os.getenv("REMINDER_HOURS", "11,14,17,20").split(",") if hour)
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", 21))
+
+# HTTP-эндпоинт /metrics для Prometheus (порт 0 - не запускать)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+
+# Запуск в несколько процессов (python supervisor.py): число обработчиков,
+# размер очереди обновлений каждого и число одновременно обрабатываемых обновлений
+SHARDS = int(os.getenv("SHARDS", os.cpu_count() or 1))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", 1000))
+SHARD_MAX_CONCURRENCY = int(os.getenv("SHARD_MAX_CONCURRENCY", 100))
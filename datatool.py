@@ -0,0 +1,161 @@
+# Пакетная выгрузка и загрузка профилей и дневной истории (файлы NumPy .npz
+# по --chunk строк), аналитика по выгрузке и пересчет целей всех профилей
+# без обращения к работающему боту.
+#
+#   python datatool.py export dump/
+#   python datatool.py import dump/
+#   python datatool.py stats dump/ --days 30
+#   python datatool.py recompute --calories
+#
+# Профили читаются из USER_DB_PATH, история - из базы сводок и журнала HISTORY_PATH.
+# При --shards N обрабатываются файлы всех шардов супервизора
+# (users.shard0.db, history.shard0.log, ...). Загрузку и пересчет нужно выполнять
+# при остановленном боте: он держит профили в памяти и перезапишет их.
+# История загружается только в пустые журналы (без базы сводок).
+import argparse
+import asyncio
+import sys
+
+from config import USER_DB_PATH, HISTORY_PATH, USER_FLUSH_BATCH
+from utils.calculation import recompute_goals
+from utils.dataset import (
+    compute_stats,
+    export_daily,
+    export_profiles,
+    import_daily,
+    import_profiles,
+    nonempty_histories
+)
+from utils.profiles import UserProfile
+from utils.shards import shard_for, shard_path
+from utils.storage import SQLiteUserStorage
+
+
+def shard_paths(path: str, shards: int) -> list[str]:
+    if shards <= 1:
+        return [path]
+    return [shard_path(path, shard) for shard in range(shards)]
+
+
+async def open_storages(shards: int) -> list[SQLiteUserStorage]:
+    storages = [
+        # Профили не кэшируются: выгрузка и загрузка проходят по ним один раз
+        SQLiteUserStorage(path, UserProfile, cache_size=0, flush_batch=USER_FLUSH_BATCH)
+        for path in shard_paths(USER_DB_PATH, shards)
+    ]
+    for storage in storages:
+        await storage.start()
+    return storages
+
+
+async def close_storages(storages: list[SQLiteUserStorage]):
+    for storage in storages:
+        await storage.close()
+
+
+async def run_export(args) -> int:
+    storages = await open_storages(args.shards)
+    try:
+        count, files = await export_profiles(storages, args.directory, args.chunk)
+    finally:
+        await close_storages(storages)
+    print(f"Профилей выгружено: {count} (файлов: {files})")
+    rows, files = await asyncio.to_thread(
+        export_daily, shard_paths(HISTORY_PATH, args.shards), args.directory, args.chunk
+    )
+    print(f"Дневных сводок выгружено: {rows} (файлов: {files})")
+    return 0
+
+
+async def run_import(args) -> int:
+    if not args.profiles_only:
+        if not HISTORY_PATH:
+            print("HISTORY_PATH не задан, история не загружена")
+            return 1
+        # Повторная загрузка удвоила бы историю: проверка до загрузки профилей
+        nonempty = nonempty_histories(shard_paths(HISTORY_PATH, args.shards))
+        if nonempty:
+            print(f"История уже содержит данные ({', '.join(nonempty)}), загрузка отменена; "
+                  "используйте --profiles-only или пустой HISTORY_PATH")
+            return 1
+    storages = await open_storages(args.shards)
+    try:
+        imported, skipped = await import_profiles(
+            storages, args.directory, lambda user_id: shard_for(user_id, len(storages))
+        )
+    finally:
+        await close_storages(storages)
+    print(f"Профилей загружено: {imported}, пропущено: {skipped}")
+    failed = skipped > 0
+    if not args.profiles_only:
+        imported, skipped = await asyncio.to_thread(
+            import_daily, shard_paths(HISTORY_PATH, args.shards), args.directory
+        )
+        print(f"Дневных сводок загружено: {imported}, пропущено: {skipped}")
+        failed = failed or skipped > 0
+    return 1 if failed else 0
+
+
+# Пересчет целей по текущим формулам (например, после их изменения)
+async def run_recompute(args) -> int:
+    storages = await open_storages(args.shards)
+    count = 0
+    try:
+        for storage in storages:
+            count += await recompute_goals(storage, calories=args.calories)
+    finally:
+        await close_storages(storages)
+    print(f"Цели пересчитаны для {count} профилей")
+    return 0
+
+
+def run_stats(args) -> int:
+    stats = compute_stats(args.directory, args.days)
+    if not stats:
+        print("В выгрузке нет профилей")
+        return 1
+    period = f"за последние {args.days} дн." if args.days else "за все время"
+    print(f"Статистика по городам {period}")
+    print(f"{'город':<24}{'польз.':>8}{'цель воды':>11}{'цель ккал':>11}{'дней':>9}"
+          f"{'вода/день':>11}{'ккал/день':>11}{'цель воды':>11}{'цель ккал':>11}")
+    for row in stats[:args.top]:
+        print(f"{row['city'][:23]:<24}{row['users']:>8}{row['avg_water_goal']:>11.0f}"
+              f"{row['avg_calorie_goal']:>11.0f}{row['user_days']:>9}{row['avg_water']:>11.0f}"
+              f"{row['avg_calories']:>11.0f}{row['water_goal_rate']:>10.1%} {row['calorie_goal_rate']:>10.1%}")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Выгрузка, загрузка и аналитика профилей и истории")
+    parser.add_argument('--shards', type=int, default=1, help="число шардов супервизора")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help="выгрузить профили и дневные сводки")
+    export.add_argument('directory')
+    export.add_argument('--chunk', type=int, default=100000, help="строк в одном файле")
+
+    load = commands.add_parser('import', help="загрузить профили и дневные сводки")
+    load.add_argument('directory')
+    load.add_argument('--profiles-only', action='store_true', help="без дневных сводок")
+
+    stats = commands.add_parser('stats', help="статистика по городам")
+    stats.add_argument('directory')
+    stats.add_argument('--days', type=int, help="только последние N дней")
+    stats.add_argument('--top', type=int, default=50, help="сколько городов вывести")
+
+    recompute = commands.add_parser('recompute', help="пересчитать цели всех профилей")
+    recompute.add_argument('--calories', action='store_true',
+                           help="пересчитать и цель по калориям (заменяет заданную вручную)")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.command == 'export':
+        sys.exit(asyncio.run(run_export(arguments)))
+    elif arguments.command == 'import':
+        sys.exit(asyncio.run(run_import(arguments)))
+    elif arguments.command == 'recompute':
+        sys.exit(asyncio.run(run_recompute(arguments)))
+    else:
+        sys.exit(run_stats(arguments))
@@ -0,0 +1,304 @@
+# Запуск бота в несколько процессов: супервизор получает обновления
+# (long polling или вебхук) и распределяет их по процессам-обработчикам
+# по id пользователя. У каждого обработчика свои профили, журнал событий
+# и состояния диалогов, а обновления одного пользователя обрабатываются
+# строго по порядку.
+#
+#   SHARDS=4 python supervisor.py
+import asyncio
+import collections
+import importlib
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+from aiohttp import web
+
+import config
+from config import (
+    check_tokens,
+    TELEGRAM_BOT_TOKEN,
+    TELEGRAM_API_URL,
+    USER_DB_PATH,
+    FSM_DB_PATH,
+    HISTORY_PATH,
+    CACHE_DIR,
+    FOOD_INDEX_PATH,
+    FOOD_OVERLAY_PATH,
+    METRICS_PORT,
+    SEND_GLOBAL_RATE,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_DRAIN_TIMEOUT,
+    SHARDS,
+    SHARD_QUEUE_SIZE,
+    SHARD_MAX_CONCURRENCY
+)
+from utils.shards import KeyedSerializer, shard_for, shard_path, update_user_id
+
+# Сигнал обработчику завершить работу
+STOP = None
+# Тайм-аут long polling (секунды)
+POLL_TIMEOUT = 30
+
+
+# Процесс-обработчик: отдельный экземпляр бота со своей частью пользователей
+def run_worker(shard: int, shards: int, updates: multiprocessing.Queue):
+    # Обработчик останавливается по команде супервизора, а не по Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Свои файлы хранилищ, кэшей и журнала продуктов и порт метрик для каждого
+    # шарда (индекс продуктов только читается и остается общим),
+    # общий лимит отправки делится между обработчиками
+    overlay_path = FOOD_OVERLAY_PATH or (FOOD_INDEX_PATH + '.new.jsonl' if FOOD_INDEX_PATH else '')
+    os.environ.update({
+        'USER_DB_PATH': shard_path(USER_DB_PATH, shard),
+        'FSM_DB_PATH': shard_path(FSM_DB_PATH, shard),
+        'HISTORY_PATH': shard_path(HISTORY_PATH, shard),
+        'CACHE_DIR': os.path.join(CACHE_DIR, f"shard{shard}") if CACHE_DIR else '',
+        'FOOD_OVERLAY_PATH': shard_path(overlay_path, shard),
+        'METRICS_PORT': str(METRICS_PORT + shard if METRICS_PORT else 0),
+        'SEND_GLOBAL_RATE': str(SEND_GLOBAL_RATE / shards)
+    })
+    # config уже загружен при импорте этого модуля, перечитываем настройки
+    importlib.reload(config)
+    asyncio.run(_worker_loop(shard, updates))
+
+
+async def _feed(bot_app, update: dict):
+    try:
+        await bot_app.dp.feed_raw_update(bot_app.bot, update)
+    except Exception:
+        logging.exception("Ошибка при обработке обновления %s", update.get('update_id'))
+
+
+async def _worker_loop(shard: int, updates: multiprocessing.Queue):
+    import app as bot_app
+
+    await bot_app.dp.emit_startup(bot=bot_app.bot)
+    logging.info("Обработчик %d запущен", shard)
+    serializer = KeyedSerializer(SHARD_MAX_CONCURRENCY)
+    # Блокирующее чтение очереди в отдельном потоке
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='shard-reader')
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            item = await loop.run_in_executor(reader, updates.get)
+            if item is STOP:
+                break
+            user_id, update = item
+            await serializer.submit(user_id, _feed(bot_app, update))
+    finally:
+        await serializer.drain(WEBHOOK_DRAIN_TIMEOUT)
+        await bot_app.dp.emit_shutdown(bot=bot_app.bot)
+        await bot_app.bot.session.close()
+        reader.shutdown(wait=False)
+        logging.info("Обработчик %d остановлен", shard)
+
+
+# Запуск и перезапуск обработчиков, распределение обновлений по ним
+class Supervisor:
+    def __init__(self, shards: int, queue_size: int):
+        self._context = multiprocessing.get_context('spawn')
+        self.queue_size = queue_size
+        self.queues = [self._context.Queue(queue_size) for _ in range(shards)]
+        self.processes: list[multiprocessing.Process | None] = [None] * shards
+        # Обновления, ожидающие места в очереди обработчика (long polling)
+        self._backlog = [collections.deque() for _ in range(shards)]
+        self._forwarders: list[asyncio.Task | None] = [None] * shards
+        self.dropped = 0
+        self._stopping = False
+
+    def _start_worker(self, shard: int):
+        process = self._context.Process(
+            target=run_worker,
+            args=(shard, len(self.queues), self.queues[shard]),
+            name=f'shard-{shard}'
+        )
+        process.start()
+        self.processes[shard] = process
+
+    def start(self):
+        for shard in range(len(self.queues)):
+            self._start_worker(shard)
+
+    def _put(self, shard: int, item: tuple) -> bool:
+        try:
+            self.queues[shard].put_nowait(item)
+        except queue.Full:
+            return False
+        return True
+
+    # Передать обновление обработчику; False, если его очередь заполнена
+    def route(self, update: dict) -> bool:
+        user_id = update_user_id(update)
+        shard = shard_for(user_id, len(self.queues))
+        # Обновления одного пользователя не обгоняют ожидающие
+        return not self._backlog[shard] and self._put(shard, (user_id, update))
+
+    # Передать обновление без ожидания: при заполненной очереди обработчика
+    # оно ждет в очереди шарда (до queue_size обновлений, дальше отбрасывается),
+    # и остальные шарды продолжают получать обновления
+    def forward(self, update: dict):
+        user_id = update_user_id(update)
+        shard = shard_for(user_id, len(self.queues))
+        backlog = self._backlog[shard]
+        if not backlog and self._put(shard, (user_id, update)):
+            return
+        if len(backlog) >= self.queue_size:
+            self.dropped += 1
+            logging.warning("Обработчик %d не успевает, обновление %s отброшено", shard, update.get('update_id'))
+            return
+        backlog.append((user_id, update))
+        if self._forwarders[shard] is None or self._forwarders[shard].done():
+            self._forwarders[shard] = asyncio.create_task(self._forward_backlog(shard))
+
+    async def _forward_backlog(self, shard: int):
+        backlog = self._backlog[shard]
+        while backlog:
+            if self._put(shard, backlog[0]):
+                backlog.popleft()
+            else:
+                await asyncio.sleep(0.05)
+
+    # Перезапуск упавших обработчиков. Обработчик мог быть убит, пока держал
+    # блокировку чтения очереди, поэтому новый получает новую очередь,
+    # а необработанные обновления старой теряются
+    async def watch(self, interval: float = 1.0):
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            for shard, process in enumerate(self.processes):
+                if process is not None and not process.is_alive() and not self._stopping:
+                    logging.warning("Обработчик %d завершился с кодом %s, перезапуск", shard, process.exitcode)
+                    self._replace_queue(shard)
+                    self._start_worker(shard)
+
+    def _replace_queue(self, shard: int):
+        old = self.queues[shard]
+        self.queues[shard] = self._context.Queue(self.queue_size)
+        try:
+            lost = old.qsize()
+        except NotImplementedError:
+            lost = -1
+        if lost:
+            logging.warning("Обработчик %d: потеряно обновлений в очереди: %s", shard, lost)
+        # Очередь никто не читает: не ждать ее фоновый поток при выходе
+        old.cancel_join_thread()
+        old.close()
+
+    # Остановка обработчиков после обработки уже принятых обновлений
+    def stop(self, timeout: float):
+        self._stopping = True
+        waiting = sum(len(backlog) for backlog in self._backlog)
+        if waiting:
+            logging.warning("Не передано обработчикам обновлений: %d", waiting)
+        for updates in self.queues:
+            try:
+                updates.put(STOP, timeout=timeout)
+            except queue.Full:
+                pass
+        for process in self.processes:
+            if process is None:
+                continue
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+def _api_url(method: str) -> str:
+    base = (TELEGRAM_API_URL or 'https://api.telegram.org/').rstrip('/')
+    return f"{base}/bot{TELEGRAM_BOT_TOKEN}/{method}"
+
+
+async def _call_api(session: aiohttp.ClientSession, method: str, **params):
+    async with session.post(_api_url(method), json=params) as response:
+        data = await response.json()
+    if not data.get('ok'):
+        raise RuntimeError(f"{method}: {data.get('description')}")
+    return data['result']
+
+
+# Long polling: обновления передаются обработчикам без разбора в модели aiogram
+async def poll_updates(supervisor: Supervisor):
+    offset = 0
+    timeout = aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        while True:
+            try:
+                updates = await _call_api(session, 'getUpdates', offset=offset, timeout=POLL_TIMEOUT)
+            except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+                logging.warning("Ошибка при получении обновлений: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                supervisor.forward(update)
+                # Подтверждается следующим запросом getUpdates
+                offset = update['update_id'] + 1
+
+
+async def main_polling(supervisor: Supervisor):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    logging.info("Супервизор запущен, обработчиков: %d", len(supervisor.queues))
+    tasks = [asyncio.create_task(poll_updates(supervisor)), asyncio.create_task(supervisor.watch())]
+    await stop.wait()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Вебхук: при заполненной очереди обработчика отвечаем 503, и Telegram повторит доставку
+def main_webhook(supervisor: Supervisor):
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise ValueError("Для режима вебхука нужны WEBHOOK_URL и WEBHOOK_SECRET")
+
+    async def handle(request: web.Request) -> web.Response:
+        if request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        if not supervisor.route(await request.json()):
+            return web.Response(status=503)
+        return web.Response()
+
+    async def lifecycle(app: web.Application):
+        async with aiohttp.ClientSession() as session:
+            await _call_api(
+                session,
+                'setWebhook',
+                url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+        watcher = asyncio.create_task(supervisor.watch())
+        yield
+        watcher.cancel()
+        await asyncio.gather(watcher, return_exceptions=True)
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle)
+    app.cleanup_ctx.append(lifecycle)
+    logging.info("Супервизор запущен в режиме вебхука, обработчиков: %d", len(supervisor.queues))
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT, access_log=None)
+
+
+if __name__ == "__main__":
+    check_tokens()
+    supervisor = Supervisor(SHARDS, SHARD_QUEUE_SIZE)
+    supervisor.start()
+    try:
+        if BOT_MODE == "webhook":
+            main_webhook(supervisor)
+        else:
+            asyncio.run(main_polling(supervisor))
+    finally:
+        supervisor.stop(WEBHOOK_DRAIN_TIMEOUT + 10)
@@ -1,41 +1,395 @@
+import asyncio
+import logging
+import os
+import random
+import time
 import aiohttp
 
-from config import OPEN_WEATHER_MAP_TOKEN
+from config import (
+    OPEN_WEATHER_MAP_TOKEN,
+    HTTP_TOTAL_TIMEOUT,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_POOL_LIMIT,
+    HTTP_POOL_LIMIT_PER_HOST,
+    HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_DNS_CACHE_TTL,
+    GEOCODE_CACHE_SIZE,
+    WEATHER_CACHE_SIZE,
+    WEATHER_CACHE_TTL,
+    WEATHER_STALE_TTL,
+    FOOD_CACHE_SIZE,
+    FOOD_CACHE_TTL,
+    FOOD_STALE_TTL,
+    OWM_TIMEOUT,
+    OFF_TIMEOUT,
+    API_DEADLINE,
+    API_RETRIES,
+    API_RETRY_DELAY,
+    BREAKER_FAILURES,
+    BREAKER_RESET,
+    CACHE_DIR,
+    FOOD_INDEX_PATH,
+    FOOD_OVERLAY_PATH,
+    OWM_API_URL,
+    OFF_API_URL
+)
+from utils.cache import LRUCache
+from utils.food_index import FoodIndex
+from utils.metrics import external_request_duration, external_requests
 
-URL_OWM = "https://api.openweathermap.org/"
-URL_OFF = "https://world.openfoodfacts.org/"
+URL_OWM = OWM_API_URL
+URL_OFF = OFF_API_URL
 
+# Координаты города не меняются, поэтому кэш геокодинга без времени жизни
+geocode_cache = LRUCache(GEOCODE_CACHE_SIZE)
+# Температура по координатам, обновляется раз в WEATHER_CACHE_TTL секунд.
+# Устаревшая температура отдается еще WEATHER_STALE_TTL секунд, пока идет обновление
+weather_cache = LRUCache(WEATHER_CACHE_SIZE, ttl=WEATHER_CACHE_TTL, stale_ttl=WEATHER_STALE_TTL)
+# Найденные продукты Open Food Facts по названию
+food_cache = LRUCache(FOOD_CACHE_SIZE, ttl=FOOD_CACHE_TTL, stale_ttl=FOOD_STALE_TTL)
+# Смещение часового пояса от UTC (секунды) по координатам, обновляется вместе с погодой
+timezone_cache = LRUCache(GEOCODE_CACHE_SIZE)
 
-async def get_data_async(url: str):
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as resp:
-            return await resp.json()
+GEOCODE_CACHE_FILE = 'geocode_cache.json'
+WEATHER_CACHE_FILE = 'weather_cache.json'
+TIMEZONE_CACHE_FILE = 'timezone_cache.json'
+FOOD_CACHE_FILE = 'food_cache.json'
+
+
+# Ошибка внешнего API: сервис недоступен, не ответил вовремя или ответил не по формату
+class ApiError(Exception):
+    pass
+
+
+# Запрос не отправлялся: предохранитель сервиса разомкнут
+class CircuitOpenError(ApiError):
+    pass
+
+
+# Город не найден геокодером
+class CityNotFoundError(ApiError):
+    pass
+
+
+# Предохранитель (circuit breaker): после failure_threshold ошибок подряд
+# запросы к сервису сразу завершаются ошибкой, через reset_timeout секунд
+# пропускается один пробный запрос. Успешный пробный запрос замыкает
+# предохранитель, неудачный - снова размыкает
+class CircuitBreaker:
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_at: float | None = None
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self.trial_at = None
+        # Пробный запрос мог быть отменен, не сообщив результат: через reset_timeout разрешаем новый
+        if self.state == self.HALF_OPEN and (self.trial_at is None or now - self.trial_at >= self.reset_timeout):
+            self.trial_at = now
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logging.info("Сервис %s снова доступен", self.name)
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            logging.warning("Сервис %s недоступен, запросы приостановлены на %g с", self.name, self.reset_timeout)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.opened += 1
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'opened': self.opened,
+            'rejected': self.rejected
+        }
+
+
+owm_breaker = CircuitBreaker('OpenWeatherMap', BREAKER_FAILURES, BREAKER_RESET)
+off_breaker = CircuitBreaker('Open Food Facts', BREAKER_FAILURES, BREAKER_RESET)
+
+# Тайм-аут попытки и предохранитель для каждого вида запросов
+ENDPOINTS = {
+    'owm_geo': (OWM_TIMEOUT, owm_breaker),
+    'owm_weather': (OWM_TIMEOUT, owm_breaker),
+    'off_search': (OFF_TIMEOUT, off_breaker)
+}
+
+
+# Объединение одновременных одинаковых запросов: все ждут один запрос
+class SingleFlight:
+    def __init__(self):
+        self._inflight: dict[object, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(self.start(key, func))
+
+    # Запустить запрос (или присоединиться к уже идущему), не дожидаясь результата
+    def start(self, key, func) -> asyncio.Task:
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.coalesced += 1
+        return task
+
+    def _forget(self, key, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Помечаем исключение как полученное, даже если все ожидающие отменены
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._inflight)
+        }
+
+
+weather_flight = SingleFlight()
+food_flight = SingleFlight()
+
+# Локальный индекс продуктов, удаленный поиск нужен только при промахе
+food_index = FoodIndex(FOOD_INDEX_PATH, FOOD_OVERLAY_PATH or None) if FOOD_INDEX_PATH else None
+
+# Общая сессия на весь процесс (пул соединений с keep-alive)
+_session: aiohttp.ClientSession | None = None
+
+
+async def start_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=HTTP_TOTAL_TIMEOUT,
+            connect=HTTP_CONNECT_TIMEOUT
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+# Ответы, после которых запрос стоит повторить
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+
+async def get_data_async(url: str, endpoint: str = 'other'):
+    # Сессия создается при первом запросе, если не была открыта при старте
+    session = await start_session()
+    attempt_timeout, breaker = ENDPOINTS.get(endpoint, (HTTP_TOTAL_TIMEOUT, None))
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + API_DEADLINE
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow():
+            external_requests.inc(endpoint, 'circuit_open')
+            raise CircuitOpenError(f"{endpoint}: сервис временно недоступен")
+        timeout = min(attempt_timeout, deadline - loop.time())
+        status = 'error'
+        try:
+            with external_request_duration.time(endpoint):
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                    status = str(resp.status)
+                    if resp.status in RETRY_STATUSES:
+                        raise ApiError(f"{endpoint}: HTTP {resp.status}")
+                    # Сервисы иногда отвечают JSON с неверным Content-Type
+                    data = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ApiError, ValueError) as e:
+            if isinstance(e, asyncio.TimeoutError):
+                status = 'timeout'
+            if breaker is not None:
+                breaker.record_failure()
+            attempt += 1
+            # Полный разброс задержки: повторы разных запросов не приходят разом
+            delay = random.uniform(0, API_RETRY_DELAY * 2 ** attempt)
+            if attempt > API_RETRIES or loop.time() + delay >= deadline:
+                raise ApiError(f"{endpoint}: {e!r}") from e
+            await asyncio.sleep(delay)
+            continue
+        finally:
+            external_requests.inc(endpoint, status)
+        if breaker is not None:
+            breaker.record_success()
+        return data
+
+
+# Приведение названия (города, продукта) к единому виду для ключа кэша
+def normalize_name(name: str) -> str:
+    return ' '.join(name.split()).casefold()
+
+
+# Загрузка кэшей с диска при старте
+def load_caches():
+    if food_index is not None:
+        food_index.open()
+    if not CACHE_DIR:
+        return
+    geocode_cache.load(os.path.join(CACHE_DIR, GEOCODE_CACHE_FILE))
+    weather_cache.load(os.path.join(CACHE_DIR, WEATHER_CACHE_FILE))
+    timezone_cache.load(os.path.join(CACHE_DIR, TIMEZONE_CACHE_FILE))
+    food_cache.load(os.path.join(CACHE_DIR, FOOD_CACHE_FILE))
+
+
+# Сохранение кэшей на диск при остановке
+def save_caches():
+    if food_index is not None:
+        food_index.close()
+    if not CACHE_DIR:
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    geocode_cache.save(os.path.join(CACHE_DIR, GEOCODE_CACHE_FILE))
+    weather_cache.save(os.path.join(CACHE_DIR, WEATHER_CACHE_FILE))
+    timezone_cache.save(os.path.join(CACHE_DIR, TIMEZONE_CACHE_FILE))
+    food_cache.save(os.path.join(CACHE_DIR, FOOD_CACHE_FILE))
+
+
+def get_cache_stats() -> dict:
+    return {
+        'geocode': geocode_cache.stats(),
+        'weather': weather_cache.stats(),
+        'food': food_cache.stats(),
+        'weather_flight': weather_flight.stats(),
+        'food_flight': food_flight.stats(),
+        'owm_breaker': owm_breaker.stats(),
+        'off_breaker': off_breaker.stats()
+    }
 
 
 async def get_weather_async(city: str):
-    # Вернет температуру
-    city_info_url = URL_OWM + \
-        f"geo/1.0/direct?q={city}&appid={OPEN_WEATHER_MAP_TOKEN}"
-    city_info = await get_data_async(city_info_url)
-    if 'cod' in city_info and city_info['cod'] == 401:
-        return 0.0
-    lat, lon = city_info[0]['lat'], city_info[0]['lon']
-    weather_url = URL_OWM + \
-        f"data/2.5/weather?lat={lat}&lon={
-            lon}&units=metric&appid={OPEN_WEATHER_MAP_TOKEN}"
-    weather = await get_data_async(weather_url)
-    return float(weather['main']['temp'])
+    # Вернет температуру; ApiError, если сервис недоступен и в кэше ничего нет
+    city_key = normalize_name(city)
+    coords = geocode_cache.get(city_key, count=False)
+    if coords is not None:
+        cached = weather_cache.get_stale(coords, count=False)
+        if cached is not None:
+            temperature, fresh = cached
+            # Учитываем попадание в оба кэша
+            geocode_cache.hits += 1
+            if fresh:
+                weather_cache.hits += 1
+            else:
+                # Устаревшая температура отдается сразу, обновление идет в фоне
+                weather_cache.stale_hits += 1
+                weather_flight.start(city_key, lambda: _fetch_weather(city, city_key))
+            return temperature
+    return await weather_flight.do(city_key, lambda: _fetch_weather(city, city_key))
+
+
+async def _fetch_weather(city: str, city_key: str):
+    coords = geocode_cache.get(city_key)
+    if coords is None:
+        city_info_url = URL_OWM + \
+            f"geo/1.0/direct?q={city}&appid={OPEN_WEATHER_MAP_TOKEN}"
+        city_info = await get_data_async(city_info_url, 'owm_geo')
+        if isinstance(city_info, dict):
+            if city_info.get('cod') == 401:
+                return 0.0
+            raise ApiError(f"owm_geo: {city_info.get('message', city_info)}")
+        if not city_info:
+            raise CityNotFoundError(city)
+        try:
+            coords = (float(city_info[0]['lat']), float(city_info[0]['lon']))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ApiError(f"owm_geo: неверный ответ {city_info[0]!r}") from e
+        geocode_cache.set(city_key, coords)
+    temperature = weather_cache.get(coords)
+    if temperature is None:
+        lat, lon = coords
+        weather_url = URL_OWM + \
+            f"data/2.5/weather?lat={lat}&lon={lon}&units=metric&appid={OPEN_WEATHER_MAP_TOKEN}"
+        weather = await get_data_async(weather_url, 'owm_weather')
+        try:
+            temperature = float(weather['main']['temp'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ApiError(f"owm_weather: неверный ответ {weather!r}") from e
+        weather_cache.set(coords, temperature)
+        if 'timezone' in weather:
+            timezone_cache.set(coords, int(weather['timezone']))
+    return temperature
+
+
+# Смещение часового пояса города от UTC в секундах по уже полученным данным
+# OpenWeatherMap (без запросов); None - погода для города еще не запрашивалась
+def get_city_utc_offset(city: str) -> int | None:
+    coords = geocode_cache.get(normalize_name(city), count=False)
+    if coords is None:
+        return None
+    return timezone_cache.get(coords, count=False)
 
 
 async def get_food_info(product_name: str):
+    if food_index is not None:
+        # Поиск по индексу (в том числе нечеткий) выполняется вне цикла событий
+        food_info = await asyncio.to_thread(food_index.lookup, product_name)
+        if food_info is not None:
+            return food_info
+    key = normalize_name(product_name)
+    cached = food_cache.get_stale(key)
+    if cached is not None:
+        food_info, fresh = cached
+        if not fresh:
+            food_flight.start(key, lambda: _fetch_food_info(product_name, key))
+        return food_info
+    return await food_flight.do(key, lambda: _fetch_food_info(product_name, key))
+
+
+async def _fetch_food_info(product_name: str, key: str):
     url = URL_OFF + \
         f"cgi/search.pl?action=process&search_terms={product_name}&json=true"
-    data = await get_data_async(url)
-    products = data.get('products', [])
+    data = await get_data_async(url, 'off_search')
+    if not isinstance(data, dict):
+        raise ApiError(f"off_search: неверный ответ {data!r}")
+    products = data.get('products') or []
     if products:  # Проверяем, есть ли найденные продукты
         first_product = products[0]
-        return {
+        food_info = {
             'name': first_product.get('product_name', 'Неизвестно'),
             'calories': first_product.get('nutriments', {}).get('energy-kcal_100g', 0)
         }
+        if food_index is not None:
+            food_index.add(product_name, food_info)
+        food_cache.set(key, food_info)
+        return food_info
     return None
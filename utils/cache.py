@@ -0,0 +1,148 @@
+import json
+import os
+import time
+from collections import OrderedDict
+
+
+# LRU-кэш с ограничением по размеру и необязательным временем жизни записей.
+# При заданном max_bytes также ограничивается суммарный len() значений.
+# stale_ttl - сколько еще секунд после истечения запись можно получить через get_stale
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: float | None = None, max_bytes: int | None = None,
+                 stale_ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+        # ключ -> (значение, время истечения или None)
+        self._data: OrderedDict = OrderedDict()
+        self._sizes: dict = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count: bool = True):
+        item = self._data.get(key)
+        if item is not None:
+            value, expires_at = item
+            if expires_at is None or expires_at > time.time():
+                self._data.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return value
+            # Запись устарела (но может еще пригодиться для get_stale)
+            if not self._keep_stale(expires_at, time.time()):
+                self.pop(key)
+        if count:
+            self.misses += 1
+        return default
+
+    def _keep_stale(self, expires_at: float | None, now: float) -> bool:
+        return expires_at is None or (self.stale_ttl is not None and expires_at + self.stale_ttl > now)
+
+    # Значение и признак свежести; устаревшая запись возвращается в пределах stale_ttl
+    def get_stale(self, key, count: bool = True) -> tuple | None:
+        item = self._data.get(key)
+        if item is not None:
+            value, expires_at = item
+            now = time.time()
+            fresh = expires_at is None or expires_at > now
+            if fresh or self._keep_stale(expires_at, now):
+                self._data.move_to_end(key)
+                if count:
+                    if fresh:
+                        self.hits += 1
+                    else:
+                        self.stale_hits += 1
+                return value, fresh
+            self.pop(key)
+        if count:
+            self.misses += 1
+        return None
+
+    def set(self, key, value, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        if self.max_bytes is not None:
+            size = len(value)
+            # Значение больше всего бюджета не кэшируется
+            if size > self.max_bytes:
+                self.pop(key)
+                return
+            self.bytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        self._evict()
+
+    # Вытеснение самых давно использованных записей
+    def _evict(self):
+        while len(self._data) > self.maxsize or \
+                (self.max_bytes is not None and self.bytes > self.max_bytes):
+            key, _ = self._data.popitem(last=False)
+            self.bytes -= self._sizes.pop(key, 0)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        self.bytes -= self._sizes.pop(key, 0)
+        return default if item is None else item[0]
+
+    def clear(self):
+        self._data.clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        stats = {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+        if self.stale_ttl is not None:
+            stats['stale_hits'] = self.stale_hits
+        if self.max_bytes is not None:
+            stats['bytes'] = self.bytes
+            stats['max_bytes'] = self.max_bytes
+        return stats
+
+    # Сохранение на диск, чтобы после перезапуска не начинать с пустого кэша
+    def save(self, path: str):
+        now = time.time()
+        items = [
+            [key, value, expires_at]
+            for key, (value, expires_at) in self._data.items()
+            if self._keep_stale(expires_at, now)
+        ]
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(items, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf-8') as f:
+            items = json.load(f)
+        now = time.time()
+        for key, value, expires_at in items:
+            if not self._keep_stale(expires_at, now):
+                continue
+            # JSON не различает кортежи и списки
+            if isinstance(key, list):
+                key = tuple(key)
+            if isinstance(value, list):
+                value = tuple(value)
+            if self.max_bytes is not None:
+                self.bytes += len(value) - self._sizes.get(key, 0)
+                self._sizes[key] = len(value)
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+        self._evict()
@@ -1,4 +1,7 @@
-from utils.api_requests import get_weather_async
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
 
 
 def calculate_calories(weight: float, height: float, age: int, activity: int):
@@ -8,7 +11,88 @@ def calculate_calories(weight: float, height: float, age: int, activity: int):
     return int(10 * weight + 6.25 * height - 5 * age + activity_calorie)
 
 
-async def calculate_water(weight: float, activity: int, temperature: float):
+def calculate_water(weight: float, activity: int, temperature: float):
     water_for_temperature = 1000 if temperature > 25 else 0
     # Возврат нужного количества воды на день
     return int(weight * 30 + 500 * activity / 30 + 500 - water_for_temperature)
+
+
+# Те же формулы для массивов numpy (по одному элементу на пользователя).
+# Порядок операций совпадает со скалярными версиями, поэтому результаты одинаковы.
+# numpy загружается при первом пакетном расчете, а не при запуске бота
+def calculate_calories_batch(weight: 'np.ndarray', height: 'np.ndarray', age: 'np.ndarray',
+                             activity: 'np.ndarray') -> 'np.ndarray':
+    import numpy as np
+    activity_calorie = 200 + np.asarray(activity, dtype=np.float64) * 4.5
+    calories = 10 * np.asarray(weight, dtype=np.float64) + 6.25 * np.asarray(height, dtype=np.float64) \
+        - 5 * np.asarray(age, dtype=np.float64) + activity_calorie
+    # Приведение к целому с отбрасыванием дробной части, как int()
+    return calories.astype(np.int64)
+
+
+def calculate_water_batch(weight: 'np.ndarray', activity: 'np.ndarray', temperature) -> 'np.ndarray':
+    import numpy as np
+    water_for_temperature = np.where(np.asarray(temperature, dtype=np.float64) > 25, 1000, 0)
+    water = np.asarray(weight, dtype=np.float64) * 30 + 500 * np.asarray(activity, dtype=np.float64) / 30 \
+        + 500 - water_for_temperature
+    return water.astype(np.int64)
+
+
+# Пересчет целей группы профилей (например, пользователей одного города).
+# temperature - новая температура для всей группы, None - взять сохраненную в профилях.
+# Цель по калориям пересчитывается только по запросу: пользователь мог задать ее сам
+def update_goals(profiles: list, temperature: float | None = None, calories: bool = False):
+    import numpy as np
+    count = len(profiles)
+    if not count:
+        return
+    weight = np.fromiter((profile.weight for profile in profiles), np.float64, count)
+    activity = np.fromiter((profile.activity for profile in profiles), np.float64, count)
+    if temperature is None:
+        temperature = np.fromiter((profile.temperature for profile in profiles), np.float64, count)
+    else:
+        for profile in profiles:
+            profile.temperature = temperature
+    for profile, water_goal in zip(profiles, calculate_water_batch(weight, activity, temperature).tolist()):
+        profile.water_goal = water_goal
+    if calories:
+        height = np.fromiter((profile.height for profile in profiles), np.float64, count)
+        age = np.fromiter((profile.age for profile in profiles), np.float64, count)
+        calorie_goals = calculate_calories_batch(weight, height, age, activity).tolist()
+        for profile, calorie_goal in zip(profiles, calorie_goals):
+            profile.calorie_goal = calorie_goal
+
+
+# Пересчет целей профилей, сгруппированных по городу (одна температура на город).
+# city_temperature - новая температура городов, для остальных берется сохраненная
+def update_city_goals(profiles: list, city_temperature: dict[str, float] | None = None, calories: bool = False):
+    city_temperature = city_temperature or {}
+    by_city: dict[str, list] = {}
+    for profile in profiles:
+        by_city.setdefault(profile.city, []).append(profile)
+    for city, group in by_city.items():
+        update_goals(group, city_temperature.get(city), calories)
+
+
+# Пересчет целей всех профилей хранилища пачками по batch_size, например после
+# изменения формул или перехода температуры городов через 25°C.
+# Возвращает число пересчитанных профилей
+async def recompute_goals(users, city_temperature: dict[str, float] | None = None, calories: bool = False,
+                          batch_size: int = 10000) -> int:
+    count = 0
+    batch = []
+    async for profile in users.iter_all(batch_size):
+        batch.append(profile)
+        if len(batch) >= batch_size:
+            count += await _save_goals(users, batch, city_temperature, calories)
+            batch = []
+    count += await _save_goals(users, batch, city_temperature, calories)
+    await users.flush()
+    return count
+
+
+async def _save_goals(users, batch: list, city_temperature: dict[str, float] | None, calories: bool) -> int:
+    update_city_goals(batch, city_temperature, calories)
+    for profile in batch:
+        await users.save(profile)
+    return len(batch)
@@ -0,0 +1,416 @@
+import glob
+import logging
+import os
+import time
+from datetime import date
+
+import numpy as np
+from pydantic import ValidationError
+
+from utils.history import (
+    EPOCH_ORDINAL,
+    LOG_RECORD,
+    WATER,
+    FOOD,
+    WORKOUT,
+    DAY_WATER,
+    DAY_CALORIES,
+    DAY_BURNED,
+    DAY_ACTIVITY,
+    DAY_FIELDS,
+    local_epoch_day,
+    history_exists,
+    iter_stored_days,
+    read_log,
+    stored_log_offset
+)
+from utils.profiles import UserProfile
+from utils.storage import UserStorage
+
+# Выгрузка - каталог с файлами по chunk_size строк:
+# profiles-00000.npz (столбцы профилей) и daily-00000.npz (дневные сводки)
+PROFILES_PATTERN = 'profiles-*.npz'
+DAILY_PATTERN = 'daily-*.npz'
+
+# Сколько строк дневных сводок держать в памяти при подсчете статистики:
+# при большей выгрузке пользователи обрабатываются частями
+STATS_PARTITION_ROWS = 10_000_000
+
+# Столбцы профиля и их типы; город хранится кодом в таблице cities
+PROFILE_COLUMNS = {
+    'id': np.int64,
+    'weight': np.float64,
+    'height': np.float64,
+    'age': np.int64,
+    'activity': np.int64,
+    'water_goal': np.int64,
+    'calorie_goal': np.int64,
+    'logged_water': np.int64,
+    'logged_calories': np.float64,
+    'burned_calories': np.int64,
+    'logged_activity': np.int64,
+    'temperature': np.float64,
+    'last_active_day': np.int64,
+    'reminders': np.bool_,
+    'quiet_start': np.int64,
+    'quiet_end': np.int64
+}
+
+# Столбцы дневной сводки в порядке полей DAY_*
+DAILY_VALUES = ('water', 'calories', 'burned', 'activity')
+
+# Запись журнала событий (LOG_RECORD) как структура numpy без выравнивания
+LOG_DTYPE = np.dtype({
+    'names': ['user_id', 'ts', 'offset', 'kind', 'amount', 'extra'],
+    'formats': ['<i8', '<u4', '<i2', 'u1', '<f4', '<f4'],
+    'offsets': [0, 8, 12, 14, 15, 19],
+    'itemsize': LOG_RECORD.size
+})
+
+
+def _chunk_path(directory: str, prefix: str, part: int) -> str:
+    return os.path.join(directory, f"{prefix}-{part:05d}.npz")
+
+
+def _chunk_files(directory: str, pattern: str) -> list[str]:
+    return sorted(glob.glob(os.path.join(directory, pattern)))
+
+
+# То же, что shards.shard_for, для массива id
+def shards_for(user_ids: np.ndarray, shards: int) -> np.ndarray:
+    mixed = user_ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return (mixed % np.uint64(shards)).astype(np.int64)
+
+
+# Местный день пользователя (как history.local_epoch_day) для массива событий журнала
+def local_days(records: np.ndarray) -> np.ndarray:
+    return (records['ts'].astype(np.int64) + records['offset'].astype(np.int64) * 60) // 86400
+
+
+# Суммирование значений с одинаковыми (user_id, day)
+def group_days(user_ids: np.ndarray, days: np.ndarray, values: np.ndarray):
+    order = np.lexsort((days, user_ids))
+    user_ids, days, values = user_ids[order], days[order], values[order]
+    if not len(order):
+        return user_ids, days, values
+    starts = np.flatnonzero(np.r_[True, (user_ids[1:] != user_ids[:-1]) | (days[1:] != days[:-1])])
+    return user_ids[starts], days[starts], np.add.reduceat(values, starts, axis=0)
+
+
+# Профили
+
+def _write_profiles(path: str, profiles: list[UserProfile]):
+    count = len(profiles)
+    columns = {
+        name: np.fromiter((getattr(profile, name) for profile in profiles), dtype, count)
+        for name, dtype in PROFILE_COLUMNS.items()
+    }
+    cities, codes = np.unique(np.array([profile.city for profile in profiles], dtype=str), return_inverse=True)
+    np.savez_compressed(path, cities=cities, city=codes.reshape(-1).astype(np.int32), **columns)
+
+
+# Выгрузка профилей хранилища частями; возвращает (число профилей, число файлов)
+async def export_profiles(storages: list[UserStorage], directory: str, chunk_size: int) -> tuple[int, int]:
+    os.makedirs(directory, exist_ok=True)
+    part = count = 0
+    chunk = []
+    for storage in storages:
+        async for profile in storage.iter_all(chunk_size):
+            chunk.append(profile)
+            if len(chunk) >= chunk_size:
+                _write_profiles(_chunk_path(directory, 'profiles', part), chunk)
+                part, count, chunk = part + 1, count + len(chunk), []
+    if chunk:
+        _write_profiles(_chunk_path(directory, 'profiles', part), chunk)
+        part, count = part + 1, count + len(chunk)
+    return count, part
+
+
+# Профили из выгрузки с проверкой через UserProfileModel; неверные строки пропускаются
+def read_profiles(path: str):
+    with np.load(path) as data:
+        columns = {name: data[name].tolist() for name in PROFILE_COLUMNS}
+        cities = data['cities'].tolist()
+        city_codes = data['city'].tolist()
+    for row, code in enumerate(city_codes):
+        fields = {name: values[row] for name, values in columns.items()}
+        last_active_day = fields.pop('last_active_day')
+        try:
+            fields['last_active_date'] = date.fromordinal(last_active_day + EPOCH_ORDINAL).isoformat()
+            yield UserProfile.validate(city=cities[code], **fields)
+        except (ValidationError, ValueError, OverflowError) as e:
+            logging.warning("Профиль %s пропущен: %s", fields.get('id'), e)
+            yield None
+
+
+# Загрузка профилей из выгрузки; route(user_id) - номер хранилища (шарда).
+# Возвращает (загружено, пропущено)
+async def import_profiles(storages: list[UserStorage], directory: str, route) -> tuple[int, int]:
+    imported = skipped = 0
+    for path in _chunk_files(directory, PROFILES_PATTERN):
+        for profile in read_profiles(path):
+            if profile is None:
+                skipped += 1
+                continue
+            await storages[route(profile.id)].save(profile)
+            imported += 1
+        # Память ограничена одним файлом выгрузки
+        for storage in storages:
+            await storage.flush()
+    return imported, skipped
+
+
+# Дневная история
+
+# События журнала -> строки (user_id, day, значения DAY_*)
+def _daily_rows(records: np.ndarray):
+    values = np.zeros((len(records), DAY_FIELDS), np.float64)
+    kind = records['kind']
+    amount = records['amount'].astype(np.float64)
+    values[kind == WATER, DAY_WATER] = amount[kind == WATER]
+    values[kind == FOOD, DAY_CALORIES] = amount[kind == FOOD]
+    workout = kind == WORKOUT
+    values[workout, DAY_ACTIVITY] = amount[workout]
+    values[workout, DAY_BURNED] = records['extra'][workout]
+    return group_days(records['user_id'].astype(np.int64), local_days(records), values)
+
+
+class _DailyWriter:
+    def __init__(self, directory: str, chunk_size: int):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.part = 0
+        self.rows = 0
+        self._buffer = []
+        self._buffered = 0
+
+    def add(self, user_ids: np.ndarray, days: np.ndarray, values: np.ndarray):
+        if len(user_ids):
+            self._buffer.append((user_ids, days, values))
+            self._buffered += len(user_ids)
+        if self._buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        user_ids, days, values = (np.concatenate(column) for column in zip(*self._buffer))
+        np.savez_compressed(
+            _chunk_path(self.directory, 'daily', self.part),
+            user_id=user_ids,
+            day=days.astype(np.int32),
+            **{name: values[:, field].astype(np.float32) for field, name in enumerate(DAILY_VALUES)}
+        )
+        self.part += 1
+        self.rows += len(user_ids)
+        self._buffer, self._buffered = [], 0
+
+
+# Выгрузка дневных сводок: сохраненные в базе истории и еще не перенесенная
+# в базу часть журнала событий, по chunk_size строк (записей) за раз.
+# Журнал пишется по времени, а местные дни пользователей в разных поясах
+# расходятся меньше чем на двое суток, поэтому сводки за дни старше
+# позавчерашнего (относительно последнего прочитанного события) уже
+# окончательны и записываются сразу; в памяти остаются только незакрытые дни.
+# Один день пользователя может попасть в несколько строк (база и журнал,
+# событие после закрытия дня) - при импорте и в статистике такие строки суммируются.
+# Возвращает (число строк, число файлов)
+def export_daily(log_paths: list[str], directory: str, chunk_size: int) -> tuple[int, int]:
+    os.makedirs(directory, exist_ok=True)
+    writer = _DailyWriter(directory, chunk_size)
+    for path in log_paths:
+        for rows in iter_stored_days(path, chunk_size):
+            stored = np.array(rows, np.float64).reshape(-1, 2 + DAY_FIELDS)
+            writer.add(np.array([row[0] for row in rows], np.int64), stored[:, 1].astype(np.int64), stored[:, 2:])
+        if not path or not os.path.exists(path):
+            continue
+        offset = stored_log_offset(path)
+        # Журнал был очищен, но смещение не успели сбросить
+        if offset > os.path.getsize(path):
+            offset = 0
+        open_ids = np.empty(0, np.int64)
+        open_days = np.empty(0, np.int64)
+        open_values = np.empty((0, DAY_FIELDS), np.float64)
+        for data, _ in read_log(path, offset, chunk_size):
+            records = np.frombuffer(data, LOG_DTYPE)
+            user_ids, days, values = _daily_rows(records)
+            open_ids, open_days, open_values = group_days(
+                np.concatenate((open_ids, user_ids)),
+                np.concatenate((open_days, days)),
+                np.concatenate((open_values, values))
+            )
+            closed = open_days < days.max() - 2
+            writer.add(open_ids[closed], open_days[closed], open_values[closed])
+            open_ids, open_days, open_values = open_ids[~closed], open_days[~closed], open_values[~closed]
+        writer.add(open_ids, open_days, open_values)
+    writer.flush()
+    return writer.rows, writer.part
+
+
+def read_daily(path: str, days: int | None = None):
+    with np.load(path) as data:
+        user_ids = data['user_id']
+        day = data['day'].astype(np.int64)
+        values = np.stack([data[name].astype(np.float64) for name in DAILY_VALUES], axis=1)
+    if days is not None:
+        recent = day > local_epoch_day(time.time(), 0) - days
+        user_ids, day, values = user_ids[recent], day[recent], values[recent]
+    return user_ids, day, values
+
+
+# Журналы, в которых уже есть история (сводки в базе или события в журнале)
+def nonempty_histories(log_paths: list[str]) -> list[str]:
+    return [path for path in log_paths if history_exists(path)]
+
+
+# Загрузка дневных сводок в журналы событий: сводка за день превращается в
+# события воды, еды и тренировки в полдень этого дня с нулевым смещением пояса,
+# так что день события совпадает с днем сводки (HistoryStore при старте
+# проигрывает их как обычные события). Загрузка возможна только в пустую
+# историю: события суммируются, и повторная загрузка удвоила бы сводки.
+# Строки с отрицательными или нечисловыми значениями пропускаются.
+# Возвращает (загружено, пропущено)
+def import_daily(log_paths: list[str], directory: str) -> tuple[int, int]:
+    nonempty = nonempty_histories(log_paths)
+    if nonempty:
+        raise ValueError(f"История уже содержит данные: {', '.join(nonempty)}")
+    imported = skipped = 0
+    for path in _chunk_files(directory, DAILY_PATTERN):
+        user_ids, days, values = read_daily(path)
+        valid = np.isfinite(values).all(axis=1) & (values >= 0).all(axis=1) & (days >= 0)
+        skipped += int((~valid).sum())
+        user_ids, days, values = user_ids[valid], days[valid], values[valid]
+        imported += len(user_ids)
+
+        ts = days * 86400 + 12 * 3600
+        events = []
+        for kind, field, extra_field in ((WATER, DAY_WATER, None), (FOOD, DAY_CALORIES, None),
+                                         (WORKOUT, DAY_ACTIVITY, DAY_BURNED)):
+            present = values[:, field] > 0
+            if extra_field is not None:
+                present |= values[:, extra_field] > 0
+            chunk = np.zeros(int(present.sum()), LOG_DTYPE)
+            chunk['user_id'] = user_ids[present]
+            chunk['ts'] = ts[present]
+            chunk['kind'] = kind
+            chunk['amount'] = values[present, field]
+            if extra_field is not None:
+                chunk['extra'] = values[present, extra_field]
+            events.append(chunk)
+        events = np.concatenate(events)
+        events = events[np.argsort(events['ts'], kind='stable')]
+
+        shard = shards_for(events['user_id'], len(log_paths))
+        for index, log_path in enumerate(log_paths):
+            with open(log_path, 'ab') as f:
+                events[shard == index].tofile(f)
+    return imported, skipped
+
+
+# Аналитика по выгрузке
+
+# Цели и города всех профилей выгрузки (только нужные столбцы, отсортированы по id)
+def _load_goals(directory: str):
+    city_index: dict[str, int] = {}
+    ids, cities, water_goals, calorie_goals = [], [], [], []
+    for path in _chunk_files(directory, PROFILES_PATTERN):
+        with np.load(path) as data:
+            # Коды городов файла -> общие коды
+            remap = np.array([city_index.setdefault(city, len(city_index)) for city in data['cities'].tolist()],
+                             np.int32)
+            ids.append(data['id'])
+            cities.append(remap[data['city']] if len(remap) else data['city'])
+            water_goals.append(data['water_goal'].astype(np.float64))
+            calorie_goals.append(data['calorie_goal'].astype(np.float64))
+    if not ids:
+        return None
+    ids = np.concatenate(ids)
+    order = np.argsort(ids)
+    return (
+        ids[order],
+        np.concatenate(cities)[order],
+        np.concatenate(water_goals)[order],
+        np.concatenate(calorie_goals)[order],
+        list(city_index)
+    )
+
+
+# Дневные сводки выгрузки, объединенные по (user_id, day) во всех файлах:
+# один день пользователя может быть в нескольких строках разных файлов.
+# Пользователи делятся по id на partitions частей, и для каждой части файлы
+# читаются заново - в памяти только строки одной части
+def _merged_daily(directory: str, days: int | None, partitions: int):
+    paths = _chunk_files(directory, DAILY_PATTERN)
+    for part in range(partitions):
+        chunks = []
+        for path in paths:
+            user_ids, day, values = read_daily(path, days)
+            if partitions > 1:
+                selected = shards_for(user_ids, partitions) == part
+                user_ids, day, values = user_ids[selected], day[selected], values[selected]
+            chunks.append(group_days(user_ids, day, values))
+        if chunks:
+            yield group_days(*(np.concatenate(column) for column in zip(*chunks)))
+
+
+def _daily_row_count(directory: str) -> int:
+    count = 0
+    for path in _chunk_files(directory, DAILY_PATTERN):
+        with np.load(path) as data:
+            count += len(data['day'])
+    return count
+
+
+# Статистика по городам: число пользователей, средние цели, средний дневной
+# прием воды и калорий и доля дней с выполненной целью (воды выпито не меньше
+# цели; калории записаны и не превышают цель). Для прошлых дней берутся
+# текущие цели из профилей. days - только последние days дней
+def compute_stats(directory: str, days: int | None = None) -> list[dict]:
+    goals = _load_goals(directory)
+    if goals is None:
+        return []
+    ids, city_codes, water_goal, calorie_goal, cities = goals
+    size = len(cities)
+    users = np.bincount(city_codes, minlength=size)
+    water_goal_sum = np.bincount(city_codes, water_goal, minlength=size)
+    calorie_goal_sum = np.bincount(city_codes, calorie_goal, minlength=size)
+    user_days = np.zeros(size, np.int64)
+    water_sum = np.zeros(size)
+    calories_sum = np.zeros(size)
+    water_met = np.zeros(size, np.int64)
+    calories_met = np.zeros(size, np.int64)
+
+    partitions = max(1, -(-_daily_row_count(directory) // STATS_PARTITION_ROWS))
+    for user_ids, day, values in _merged_daily(directory, days, partitions):
+        # Строки пользователей без профиля в выгрузке не учитываются
+        position = np.minimum(np.searchsorted(ids, user_ids), len(ids) - 1)
+        known = ids[position] == user_ids
+        position, values = position[known], values[known]
+        city = city_codes[position]
+        water = values[:, DAY_WATER]
+        calories = values[:, DAY_CALORIES]
+        user_days += np.bincount(city, minlength=size)
+        water_sum += np.bincount(city, water, minlength=size)
+        calories_sum += np.bincount(city, calories, minlength=size)
+        water_met += np.bincount(city[water >= water_goal[position]], minlength=size)
+        calories_met += np.bincount(
+            city[(calories > 0) & (calories <= calorie_goal[position])], minlength=size
+        )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logged = np.maximum(user_days, 1)
+        columns = {
+            'users': users,
+            'avg_water_goal': water_goal_sum / np.maximum(users, 1),
+            'avg_calorie_goal': calorie_goal_sum / np.maximum(users, 1),
+            'user_days': user_days,
+            'avg_water': water_sum / logged,
+            'avg_calories': calories_sum / logged,
+            'water_goal_rate': water_met / logged,
+            'calorie_goal_rate': calories_met / logged
+        }
+    order = np.argsort(-users, kind='stable')
+    return [
+        {'city': cities[index], **{name: column[index].item() for name, column in columns.items()}}
+        for index in order.tolist()
+    ]
@@ -0,0 +1,222 @@
+import csv
+import difflib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+
+# Формат файла индекса:
+#   заголовок: MAGIC (8 байт) и число записей (uint64)
+#   таблица смещений записей (uint64 на запись)
+#   записи "ключ\tназвание\tккал\n", отсортированные по ключу
+MAGIC = b'FOODIDX1'
+HEADER = struct.Struct('<8sQ')
+OFFSET_SIZE = 8
+
+# Сколько записей с общим началом рассматривать при нечетком поиске
+FUZZY_CANDIDATES = 500
+FUZZY_CUTOFF = 0.75
+
+_non_word = re.compile(r'[^\w]+')
+
+
+# Ключ продукта: нижний регистр, без знаков препинания, ё -> е
+def normalize_food_name(name: str) -> str:
+    name = name.casefold().replace('ё', 'е')
+    return ' '.join(_non_word.sub(' ', name).split())
+
+
+def _clean(text: str) -> str:
+    return ' '.join(str(text).split())
+
+
+def _parse_kcal(value) -> float | None:
+    try:
+        kcal = float(value)
+    except (TypeError, ValueError):
+        return None
+    return kcal if kcal >= 0 else None
+
+
+# Чтение продуктов из выгрузки Open Food Facts (CSV/TSV или JSONL)
+def read_products(path: str):
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                product = json.loads(line)
+                kcal = product.get('energy-kcal_100g')
+                if kcal is None:
+                    kcal = product.get('nutriments', {}).get('energy-kcal_100g')
+                yield product.get('product_name'), kcal
+    else:
+        csv.field_size_limit(sys.maxsize)
+        with open(path, encoding='utf-8', newline='') as f:
+            # Выгрузка Open Food Facts разделена табуляцией
+            dialect = 'excel-tab' if '\t' in f.readline() else 'excel'
+            f.seek(0)
+            for row in csv.DictReader(f, dialect=dialect):
+                yield row.get('product_name'), row.get('energy-kcal_100g')
+
+
+# Построение индекса из выгрузки продуктов
+def build_index(source_path: str, index_path: str) -> int:
+    records = {}
+    for name, kcal in read_products(source_path):
+        kcal = _parse_kcal(kcal)
+        if not name or kcal is None:
+            continue
+        key = normalize_food_name(name)
+        # Первый продукт с таким названием, как и в поиске Open Food Facts
+        if key and key not in records:
+            records[key] = f"{key}\t{_clean(name)}\t{kcal:g}\n".encode('utf-8')
+    keys = sorted(records, key=lambda k: k.encode('utf-8'))
+    offsets = []
+    position = 0
+    for key in keys:
+        offsets.append(position)
+        position += len(records[key])
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(keys)))
+        f.write(struct.pack(f'<{len(offsets)}Q', *offsets))
+        for key in keys:
+            f.write(records[key])
+    os.replace(tmp_path, index_path)
+    return len(keys)
+
+
+# Локальный индекс продуктов (файл отображается в память) и журнал
+# продуктов, найденных через удаленный API
+class FoodIndex:
+    def __init__(self, path: str, overlay_path: str | None = None):
+        self.path = path
+        self.overlay_path = overlay_path if overlay_path is not None else path + '.new.jsonl'
+        self._file = None
+        self._mmap = None
+        self._offsets = None
+        self._data_start = 0
+        self.count = 0
+        self._overlay: dict[str, dict] = {}
+        self._overlay_file = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        if os.path.exists(self.path) and os.path.getsize(self.path) > HEADER.size:
+            self._file = open(self.path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, self.count = HEADER.unpack_from(self._mmap, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} не является индексом продуктов")
+            table_end = HEADER.size + self.count * OFFSET_SIZE
+            self._offsets = memoryview(self._mmap)[HEADER.size:table_end].cast('Q')
+            self._data_start = table_end
+        if os.path.exists(self.overlay_path):
+            with open(self.overlay_path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        item = json.loads(line)
+                        self._overlay[item['key']] = {'name': item['name'], 'calories': item['calories']}
+        self._overlay_file = open(self.overlay_path, 'a', encoding='utf-8')
+
+    def close(self):
+        if self._offsets is not None:
+            self._offsets.release()
+            self._offsets = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._overlay_file is not None:
+            self._overlay_file.close()
+            self._overlay_file = None
+
+    def _record(self, i: int) -> bytes:
+        start = self._data_start + self._offsets[i]
+        end = self._mmap.find(b'\n', start)
+        return self._mmap[start:end]
+
+    def _key(self, i: int) -> bytes:
+        record = self._record(i)
+        return record[:record.index(b'\t')]
+
+    # Первая позиция, где ключ >= key
+    def _lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _result(self, i: int) -> dict:
+        _, name, kcal = self._record(i).decode('utf-8').split('\t')
+        return {'name': name, 'calories': float(kcal)}
+
+    def _search_index(self, key: str) -> dict | None:
+        if not self.count:
+            return None
+        key_bytes = key.encode('utf-8')
+        i = self._lower_bound(key_bytes)
+        # Точное совпадение или самый короткий ключ с таким началом
+        if i < self.count and self._key(i).startswith(key_bytes):
+            return self._result(i)
+        # Нечеткий поиск среди ключей с таким же началом (сначала с тремя
+        # общими символами, затем с одним - на случай опечатки в начале)
+        for prefix_len in (3, 1):
+            prefix = key[:prefix_len].encode('utf-8')
+            start = self._lower_bound(prefix)
+            candidates = {}
+            for j in range(start, min(start + FUZZY_CANDIDATES, self.count)):
+                candidate = self._key(j)
+                if not candidate.startswith(prefix):
+                    break
+                candidates[candidate.decode('utf-8')] = j
+            matches = difflib.get_close_matches(key, candidates, n=1, cutoff=FUZZY_CUTOFF)
+            if matches:
+                return self._result(candidates[matches[0]])
+        return None
+
+    def lookup(self, name: str) -> dict | None:
+        key = normalize_food_name(name)
+        if not key:
+            return None
+        found = self._overlay.get(key)
+        if found is not None:
+            return found
+        return self._search_index(key)
+
+    # Запись продукта, найденного через удаленный API
+    def add(self, query: str, info: dict):
+        key = normalize_food_name(query)
+        if not key:
+            return
+        with self._lock:
+            self._overlay[key] = info
+            if self._overlay_file is not None:
+                self._overlay_file.write(json.dumps({'key': key, **info}, ensure_ascii=False) + '\n')
+                self._overlay_file.flush()
+
+
+if __name__ == '__main__':
+    # python -m utils.food_index build <выгрузка.csv|jsonl> <индекс>
+    # python -m utils.food_index lookup <индекс> <название>
+    command = sys.argv[1] if len(sys.argv) > 1 else ''
+    if command == 'build' and len(sys.argv) == 4:
+        print(f"Записано продуктов: {build_index(sys.argv[2], sys.argv[3])}")
+    elif command == 'lookup' and len(sys.argv) >= 4:
+        index = FoodIndex(sys.argv[2])
+        index.open()
+        print(index.lookup(' '.join(sys.argv[3:])))
+        index.close()
+    else:
+        print("Использование: build <выгрузка> <индекс> | lookup <индекс> <название>")
+        sys.exit(1)
@@ -0,0 +1,177 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+# Поля записи в кэше: состояние, данные, время истечения (0 - пустая запись)
+STATE = 0
+DATA = 1
+EXPIRES = 2
+
+
+# Хранение состояний диалогов (FSM) в SQLite с отложенной пакетной записью.
+# Прочитанные записи (в том числе пустые) кэшируются, поэтому проверка
+# состояния на каждое сообщение обычно не обращается к базе.
+# Незавершенные диалоги удаляются через ttl секунд после последнего изменения
+class SQLiteFSMStorage(BaseStorage):
+    def __init__(self, path: str, ttl: float = 86400, cache_size: int = 10000,
+                 flush_interval: float = 5.0, flush_batch: int = 500):
+        self.path = path
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.key_builder = DefaultKeyBuilder(with_business_connection_id=True, with_destiny=True)
+        # Все обращения к соединению идут из одного потока
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-storage')
+        self._conn: sqlite3.Connection | None = None
+        self._hot: OrderedDict[str, list] = OrderedDict()
+        # Измененные, но еще не записанные записи
+        self._dirty: dict[str, list] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self._pending_flush: asyncio.Task | None = None
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm "
+            "(key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS fsm_expires_at ON fsm (expires_at)")
+        conn.commit()
+        self._conn = conn
+
+    def _select_one(self, name: str):
+        return self._conn.execute(
+            "SELECT state, data, expires_at FROM fsm WHERE key = ?", (name,)
+        ).fetchone()
+
+    def _write(self, rows: list[tuple], deleted: list[tuple], now: float):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO fsm (key, state, data, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, "
+                "data = excluded.data, expires_at = excluded.expires_at",
+                rows
+            )
+            self._conn.executemany("DELETE FROM fsm WHERE key = ?", deleted)
+            # Брошенные диалоги
+            self._conn.execute("DELETE FROM fsm WHERE expires_at < ?", (now,))
+
+    def _close_conn(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def start(self):
+        await self._run(self._connect)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Ошибка при записи состояний диалогов в базу")
+
+    def _remember(self, name: str, entry: list):
+        self._hot[name] = entry
+        self._hot.move_to_end(name)
+        # Вытесненные измененные записи остаются в _dirty до записи
+        while len(self._hot) > self.cache_size:
+            self._hot.popitem(last=False)
+
+    async def _entry(self, key: StorageKey) -> tuple[str, list]:
+        name = self.key_builder.build(key)
+        entry = self._dirty.get(name) or self._hot.get(name)
+        if entry is None:
+            row = await self._run(self._select_one, name)
+            # Пока шло чтение, запись могла загрузить или изменить другая задача
+            entry = self._dirty.get(name) or self._hot.get(name)
+            if entry is None:
+                entry = [row[0], json.loads(row[1]), row[2]] if row else [None, {}, 0]
+        if entry[EXPIRES] and entry[EXPIRES] < time.time():
+            entry[STATE], entry[DATA], entry[EXPIRES] = None, {}, 0
+        self._remember(name, entry)
+        return name, entry
+
+    def _touch(self, name: str, entry: list):
+        empty = entry[STATE] is None and not entry[DATA]
+        entry[EXPIRES] = 0 if empty else time.time() + self.ttl
+        self._dirty[name] = entry
+        # Не ждем периодической записи, если накопилось много изменений
+        if len(self._dirty) >= self.flush_batch and \
+                (self._pending_flush is None or self._pending_flush.done()):
+            self._pending_flush = asyncio.create_task(self.flush())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name, entry = await self._entry(key)
+        entry[STATE] = state.state if isinstance(state, State) else state
+        self._touch(name, entry)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, entry = await self._entry(key)
+        return entry[STATE]
+
+    async def set_data(self, key: StorageKey, data: dict[str, Any]) -> None:
+        name, entry = await self._entry(key)
+        entry[DATA] = dict(data)
+        self._touch(name, entry)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, entry = await self._entry(key)
+        return dict(entry[DATA])
+
+    async def flush(self):
+        async with self._flush_lock:
+            now = time.time()
+            batch, self._dirty = self._dirty, {}
+            # Сериализация в потоке цикла событий, чтобы получить согласованный снимок
+            rows, deleted = [], []
+            for name, (state, data, expires_at) in batch.items():
+                if expires_at:
+                    rows.append((name, state, json.dumps(data, ensure_ascii=False), expires_at))
+                else:
+                    deleted.append((name,))
+            try:
+                await self._run(self._write, rows, deleted, now)
+            except Exception:
+                # Вернуть в буфер все, что не было изменено заново
+                for name, entry in batch.items():
+                    self._dirty.setdefault(name, entry)
+                raise
+
+    async def close(self) -> None:
+        if self._conn is None:
+            return
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        await self._run(self._close_conn)
+        self._executor.shutdown(wait=True)
+
+
+def create_fsm_storage(kind: str, path: str, ttl: float, cache_size: int,
+                       flush_interval: float, flush_batch: int) -> BaseStorage:
+    if kind == 'sqlite':
+        return SQLiteFSMStorage(path, ttl, cache_size, flush_interval, flush_batch)
+    if kind == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Неизвестный тип хранилища состояний: {kind}")
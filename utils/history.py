@@ -0,0 +1,414 @@
+import asyncio
+import glob
+import logging
+import os
+import sqlite3
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+# Типы событий
+WATER = 0
+FOOD = 1
+WORKOUT = 2
+
+# Запись в журнале на диске: id пользователя (int64), время (uint32), смещение
+# пояса пользователя от UTC в минутах (int16), тип (uint8), количество и доп.
+# значение (float32)
+LOG_RECORD = struct.Struct('<qIhBff')
+
+# Поля дневной сводки
+DAY_WATER = 0
+DAY_CALORIES = 1
+DAY_BURNED = 2
+DAY_ACTIVITY = 3
+DAY_FIELDS = 4
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Сколько записей журнала читать за раз при восстановлении
+LOG_CHUNK = 65536
+
+
+# Номер дня от 1970-01-01 в часовом поясе со смещением offset (секунды от UTC).
+# По нему делятся на дни и счетчики профиля, и история пользователя
+def local_epoch_day(ts: float, offset: int) -> int:
+    return int((ts + offset) // 86400)
+
+
+# База дневных сводок рядом с журналом: history.log -> history.db
+# (без журнала сводки хранятся только в памяти)
+def history_db_path(log_path: str) -> str:
+    if not log_path:
+        return ':memory:'
+    return os.path.splitext(log_path)[0] + '.db'
+
+
+# Журнал частями по chunk_size записей начиная с offset: (данные, смещение после них).
+# Неполная запись в конце (обрыв при записи) отбрасывается
+def read_log(path: str, offset: int = 0, chunk_size: int = LOG_CHUNK):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            data = f.read(chunk_size * LOG_RECORD.size)
+            usable = len(data) - len(data) % LOG_RECORD.size
+            if not usable:
+                break
+            offset += usable
+            yield data[:usable], offset
+
+
+def _select_meta(conn: sqlite3.Connection, key: str) -> int | None:
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+# Сколько байт журнала уже перенесено в базу сводок
+def _select_log_offset(conn: sqlite3.Connection) -> int:
+    return _select_meta(conn, 'log_offset') or 0
+
+
+# Архив журнала за дни, начиная с day: history.log -> history.log.2026-10-17
+def log_archive_path(log_path: str, day: int) -> str:
+    return f"{log_path}.{date.fromordinal(day + EPOCH_ORDINAL).isoformat()}"
+
+
+# Архивы журнала: [(первый день архива, путь)]
+def log_archives(log_path: str) -> list[tuple[int, str]]:
+    archives = []
+    for path in glob.glob(glob.escape(log_path) + '.*'):
+        try:
+            day = date.fromisoformat(path[len(log_path) + 1:]).toordinal() - EPOCH_ORDINAL
+        except ValueError:
+            continue
+        archives.append((day, path))
+    return sorted(archives)
+
+
+# Состояние сохраненной истории без запуска хранилища (для выгрузки):
+# смещение необработанной части журнала
+def stored_log_offset(log_path: str) -> int:
+    db_path = history_db_path(log_path)
+    if not os.path.exists(db_path):
+        return 0
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return _select_log_offset(conn)
+    finally:
+        conn.close()
+
+
+# Есть ли сохраненная история: события в журнале или сводки в базе
+def history_exists(log_path: str) -> bool:
+    if os.path.exists(log_path) and os.path.getsize(log_path) > 0:
+        return True
+    db_path = history_db_path(log_path)
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return conn.execute("SELECT 1 FROM days LIMIT 1").fetchone() is not None
+    finally:
+        conn.close()
+
+
+# Сохраненные дневные сводки частями: списки (user_id, day, water, calories, burned, activity)
+def iter_stored_days(log_path: str, chunk_size: int):
+    db_path = history_db_path(log_path)
+    if not os.path.exists(db_path):
+        return
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        cursor = conn.execute(
+            "SELECT user_id, day, water, calories, burned, activity FROM days ORDER BY user_id, day"
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+# Добавить событие к сводкам {user_id: {day: [поля DAY_*]}}
+def _add_event(rollups: dict, user_id: int, day: int, kind: int, amount: float, extra: float):
+    days = rollups.get(user_id)
+    if days is None:
+        days = rollups[user_id] = {}
+    values = days.get(day)
+    if values is None:
+        values = days[day] = [0.0] * DAY_FIELDS
+    if kind == WATER:
+        values[DAY_WATER] += amount
+    elif kind == FOOD:
+        values[DAY_CALORIES] += amount
+    elif kind == WORKOUT:
+        values[DAY_ACTIVITY] += amount
+        values[DAY_BURNED] += extra
+
+
+def _merge_rollups(target: dict, source: dict):
+    for user_id, days in source.items():
+        target_days = target.setdefault(user_id, {})
+        for day, values in days.items():
+            target_values = target_days.get(day)
+            if target_values is None:
+                target_days[day] = list(values)
+            else:
+                for field in range(DAY_FIELDS):
+                    target_values[field] += values[field]
+
+
+# Дневные сводки пользователей в SQLite и журнал событий. События дописываются
+# в журнал (раз в flush_interval) и суммируются в памяти; раз в snapshot_interval
+# суммы переносятся в базу вместе со смещением журнала (одной транзакцией).
+# При старте проигрывается только не перенесенная часть журнала, в памяти -
+# только сводки после снимка. Журнал раз в сутки (по UTC) переименовывается
+# в архив (history.log.<первый день>); архивы старше retention_days удаляются
+class HistoryStore:
+    def __init__(self, path: str = '', retention_days: int = 400, flush_interval: float = 5.0,
+                 snapshot_interval: float = 300.0):
+        self.path = path
+        self.db_path = history_db_path(path)
+        self.retention_days = retention_days
+        self.flush_interval = flush_interval
+        self.snapshot_interval = snapshot_interval
+        # Все обращения к базе идут из одного потока
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history')
+        self._conn: sqlite3.Connection | None = None
+        # Сводки после последнего снимка и сводки снимка, который сейчас записывается
+        self._rollups: dict[int, dict[int, list[float]]] = {}
+        self._snapshotting: dict[int, dict[int, list[float]]] = {}
+        self._snapshots = 0
+        self._purged_day = -1
+        # День (UTC), с которого пишется текущий журнал
+        self._log_day = 0
+        self._buffer = bytearray()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS days (user_id INTEGER NOT NULL, day INTEGER NOT NULL, "
+            "water REAL NOT NULL, calories REAL NOT NULL, burned REAL NOT NULL, activity REAL NOT NULL, "
+            "PRIMARY KEY (user_id, day)) WITHOUT ROWID"
+        )
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.commit()
+        self._conn = conn
+
+    # Прибавить сводки к сохраненным и запомнить, до какого места журнал перенесен
+    def _store(self, rollups: dict, log_offset: int, min_day: int | None):
+        rows = [
+            (user_id, day, *values)
+            for user_id, days in rollups.items()
+            for day, values in days.items()
+        ]
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO days (user_id, day, water, calories, burned, activity) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(user_id, day) DO UPDATE SET water = water + excluded.water, "
+                "calories = calories + excluded.calories, burned = burned + excluded.burned, "
+                "activity = activity + excluded.activity",
+                rows
+            )
+            self._set_log_offset(log_offset)
+            if min_day is not None:
+                self._conn.execute("DELETE FROM days WHERE day < ?", (min_day,))
+
+    def _set_meta(self, key: str, value: int):
+        self._conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    def _set_log_offset(self, log_offset: int):
+        self._set_meta('log_offset', log_offset)
+
+    def _log_size(self) -> int:
+        return os.path.getsize(self.path) if self.path and os.path.exists(self.path) else 0
+
+    # Перенос журнала, уже перенесенного в базу, в архив и удаление старых архивов
+    def _rotate_log(self, today: int, min_day: int):
+        if self._log_size():
+            archive = log_archive_path(self.path, self._log_day)
+            if os.path.exists(archive):
+                # Повтор после сбоя между переименованием и записью смещения
+                with open(self.path, 'rb') as source, open(archive, 'ab') as target:
+                    target.write(source.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, archive)
+        with self._conn:
+            self._set_log_offset(0)
+            self._set_meta('log_day', today)
+        self._log_day = today
+        # Архив удаляется, когда следующий за ним (или текущий журнал) начинается
+        # не позже min_day: все его события старше срока хранения
+        archives = log_archives(self.path)
+        starts = [day for day, _ in archives[1:]] + [today]
+        for (_, path), next_day in zip(archives, starts):
+            if next_day <= min_day:
+                os.remove(path)
+
+    # Перенос в базу той части журнала, которая не попала в последний снимок
+    def _recover(self):
+        self._connect()
+        log_day = _select_meta(self._conn, 'log_day')
+        if log_day is None:
+            log_day = local_epoch_day(time.time(), 0)
+            with self._conn:
+                self._set_meta('log_day', log_day)
+        self._log_day = log_day
+        offset = _select_log_offset(self._conn)
+        # Журнал был перенесен в архив, но смещение не успели сбросить
+        if offset > self._log_size():
+            offset = 0
+            with self._conn:
+                self._set_log_offset(0)
+        if not self.path or not os.path.exists(self.path):
+            return
+        for data, offset in read_log(self.path, offset):
+            rollups = {}
+            for user_id, ts, offset_minutes, kind, amount, extra in LOG_RECORD.iter_unpack(data):
+                _add_event(rollups, user_id, local_epoch_day(ts, offset_minutes * 60), kind, amount, extra)
+            self._store(rollups, offset, None)
+
+    def _append(self, data: bytes):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    def _select_days(self, user_id: int, first: int, last: int):
+        return self._conn.execute(
+            "SELECT day, water, calories, burned, activity FROM days "
+            "WHERE user_id = ? AND day BETWEEN ? AND ?",
+            (user_id, first, last)
+        ).fetchall()
+
+    def _close_conn(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def start(self):
+        await self._run(self._recover)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        last_snapshot = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                if time.monotonic() - last_snapshot >= self.snapshot_interval:
+                    last_snapshot = time.monotonic()
+                    await self.snapshot()
+                else:
+                    await self.flush()
+            except Exception:
+                logging.exception("Ошибка при записи журнала событий")
+
+    # Событие пользователя; offset - смещение его часового пояса от UTC в секундах
+    def record(self, user_id: int, kind: int, amount: float, extra: float = 0.0, offset: int = 0,
+               ts: float | None = None):
+        ts = int(time.time() if ts is None else ts)
+        _add_event(self._rollups, user_id, local_epoch_day(ts, offset), kind, amount, extra)
+        if self.path:
+            self._buffer += LOG_RECORD.pack(user_id, ts, offset // 60, kind, amount, extra)
+
+    async def _flush_buffer(self):
+        if not self._buffer:
+            return
+        data, self._buffer = bytes(self._buffer), bytearray()
+        try:
+            await self._run(self._append, data)
+        except Exception:
+            # Вернуть данные в начало буфера, чтобы записать их позже
+            self._buffer[0:0] = data
+            raise
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush_buffer()
+
+    # Перенос сводок из памяти в базу (и раз в сутки - журнала в архив)
+    async def snapshot(self):
+        async with self._flush_lock:
+            # Сводки и еще не записанные события забираются вместе, до первого
+            # ожидания: событие, записанное во время снимка, попадает и в сводки,
+            # и в журнал уже следующего снимка
+            rollups, self._rollups = self._rollups, {}
+            data, self._buffer = bytes(self._buffer), bytearray()
+            self._snapshotting = rollups
+            # Граница хранения - по UTC: точность до суток здесь не важна
+            today = local_epoch_day(time.time(), 0)
+            # Старые дни удаляются раз в день
+            min_day = today - self.retention_days + 1 if today != self._purged_day else None
+            appended = False
+            try:
+                if data:
+                    await self._run(self._append, data)
+                appended = True
+                await self._run(self._store, rollups, self._log_size(), min_day)
+            except Exception:
+                # События остаются (или снова ставятся) в журнал и в памяти до следующего снимка
+                if not appended:
+                    self._buffer[0:0] = data
+                _merge_rollups(self._rollups, rollups)
+                raise
+            finally:
+                self._snapshotting = {}
+                self._snapshots += 1
+            if min_day is not None:
+                self._purged_day = today
+            if self.path and today > self._log_day:
+                await self._run(self._rotate_log, today, today - self.retention_days + 1)
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        if self._conn is not None:
+            await self.snapshot()
+            await self._run(self._close_conn)
+        self._executor.shutdown(wait=True)
+
+    # Сводка за последние days дней, заканчивая today (местным днем пользователя)
+    async def summary(self, user_id: int, days: int, today: int) -> dict:
+        last = today
+        first = last - days + 1
+        while True:
+            snapshots = self._snapshots
+            rows = await self._run(self._select_days, user_id, first, last)
+            # Пока шло чтение, снимок мог перенести сводки из памяти в базу
+            if snapshots == self._snapshots:
+                break
+        # Сохраненные сводки и сводки после снимка
+        totals = {user_id: {day: list(values) for day, *values in rows}}
+        for rollups in (self._snapshotting, self._rollups):
+            recent = {day: values for day, values in rollups.get(user_id, {}).items() if first <= day <= last}
+            _merge_rollups(totals, {user_id: recent})
+        sums = [0.0] * DAY_FIELDS
+        active_days = 0
+        for values in totals[user_id].values():
+            if any(values):
+                active_days += 1
+                for field in range(DAY_FIELDS):
+                    sums[field] += values[field]
+        return {
+            'days': days,
+            'active_days': active_days,
+            'water': sums[DAY_WATER],
+            'calories': sums[DAY_CALORIES],
+            'burned': sums[DAY_BURNED],
+            'activity': sums[DAY_ACTIVITY]
+        }
@@ -0,0 +1,97 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Стандартные атрибуты LogRecord, все остальное - поля из extra
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+# Форматирование записи в одну строку JSON
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+# Передача записей в очередь без форматирования: строка собирается только
+# в фоновом потоке и только для записей, которые действительно выводятся.
+# Аргументы записи должны быть неизменяемыми (строки, числа)
+class LazyQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Лучше потерять запись, чем задержать обработку сообщений
+            self.dropped += 1
+
+
+# Выборка доли частых сообщений. Проверяется до вызова логгера,
+# чтобы не создавать запись, которая будет отброшена
+class Sampler:
+    def __init__(self, rate: float):
+        self.rate = rate
+
+    def sample(self) -> bool:
+        return self.rate >= 1 or random.random() < self.rate
+
+
+_listener: QueueListener | None = None
+_queue_handler: LazyQueueHandler | None = None
+
+
+# Настройка логирования: записи кладутся в очередь, а пишет их фоновый поток
+def setup_logging(level: int, fmt: str = 'json', queue_size: int = 10000) -> LazyQueueHandler:
+    global _listener, _queue_handler
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if fmt == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    log_queue = queue.Queue(queue_size)
+    root = logging.getLogger()
+    root.handlers.clear()
+    _queue_handler = LazyQueueHandler(log_queue)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+    if _listener is not None:
+        _listener.stop()
+    else:
+        atexit.register(stop_logging)
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    return _queue_handler
+
+
+# Число записей, отброшенных из-за переполнения очереди
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+# Дописать оставшиеся в очереди записи
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
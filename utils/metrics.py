@@ -0,0 +1,176 @@
+import bisect
+import time
+from contextlib import contextmanager
+
+# Границы корзин гистограмм по умолчанию (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def header(self) -> list[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+# Монотонно растущий счетчик
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def collect(self) -> list[str]:
+        return self.header() + [
+            f'{self.name}{_format_labels(self.label_names, labels)} {value}'
+            for labels, value in self._values.items()
+        ]
+
+
+# Текущее значение. Можно задать функцию, которая вызывается при сборе метрик
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), func=None):
+        super().__init__(name, documentation, labels)
+        self._values: dict[tuple, float] = {}
+        self.func = func
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def collect(self) -> list[str]:
+        values = self._values
+        if self.func is not None:
+            # Функция возвращает число или словарь {кортеж меток: значение}
+            result = self.func()
+            values = result if isinstance(result, dict) else {(): result}
+        return self.header() + [
+            f'{self.name}{_format_labels(self.label_names, labels)} {value}'
+            for labels, value in values.items()
+        ]
+
+
+# Гистограмма длительностей
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счетчики по корзинам..., сумма, количество]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            data[index] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def collect(self) -> list[str]:
+        lines = self.header()
+        for labels, data in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                bucket_labels = _format_labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            bucket_labels = _format_labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{bucket_labels} {data[-1]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, labels)} {data[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, labels)} {data[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = (), func=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, func))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+# Метрики внешних API
+external_request_duration = registry.histogram(
+    'external_request_duration_seconds', 'Длительность запросов к внешним API', ('endpoint',)
+)
+external_requests = registry.counter(
+    'external_requests_total', 'Запросы к внешним API по статусу ответа', ('endpoint', 'status')
+)
+# Метрики рендера графиков
+chart_render_duration = registry.histogram(
+    'chart_render_duration_seconds', 'Длительность рендера графика выполнения целей'
+)
+
+
+# Запуск HTTP-сервера с эндпоинтом /metrics
+async def start_metrics_server(host: str, port: int):
+    # aiohttp.web нужен только для сервера метрик, поэтому загружается при его запуске
+    from aiohttp import web
+
+    async def _handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,106 @@
+import json
+import sys
+from datetime import date
+from operator import attrgetter
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from utils.history import EPOCH_ORDINAL
+
+# Тихие часы по умолчанию (местное время): напоминания не отправляются с 22 до 8
+DEFAULT_QUIET_START = 22
+DEFAULT_QUIET_END = 8
+
+
+# Схема профиля для проверки данных на входе (создание профиля, импорт).
+# Внутри бота профиль хранится в компактном виде (UserProfile)
+class UserProfileModel(BaseModel):
+    # NaN и бесконечности (например, из импортируемых файлов) не принимаются
+    model_config = ConfigDict(allow_inf_nan=False)
+
+    id: int
+    weight: float
+    height: float
+    age: int
+    activity: int
+    city: str
+    water_goal: int
+    calorie_goal: int
+    logged_water: int
+    logged_calories: float
+    burned_calories: int
+    logged_activity: int
+    temperature: float
+    last_active_date: str
+    reminders: bool = True
+    quiet_start: int = Field(DEFAULT_QUIET_START, ge=0, le=23)
+    quiet_end: int = Field(DEFAULT_QUIET_END, ge=0, le=23)
+
+
+# Профиль пользователя без накладных расходов pydantic: только слоты,
+# дата последней активности - номер дня от 1970-01-01, названия городов
+# хранятся в одном экземпляре на все профили
+class UserProfile:
+    FIELDS = (
+        'id', 'weight', 'height', 'age', 'activity', 'city', 'water_goal', 'calorie_goal',
+        'logged_water', 'logged_calories', 'burned_calories', 'logged_activity', 'temperature',
+        'last_active_day', 'reminders', 'quiet_start', 'quiet_end'
+    )
+    # __weakref__: хранилище находит уже загруженный экземпляр профиля по id
+    __slots__ = FIELDS + ('__weakref__',)
+
+    def __init__(self, id: int, weight: float, height: float, age: int, activity: int, city: str,
+                 water_goal: int, calorie_goal: int, logged_water: int, logged_calories: float,
+                 burned_calories: int, logged_activity: int, temperature: float, last_active_day: int,
+                 reminders: bool = True, quiet_start: int = DEFAULT_QUIET_START,
+                 quiet_end: int = DEFAULT_QUIET_END):
+        self.id = id
+        self.weight = weight
+        self.height = height
+        self.age = age
+        self.activity = activity
+        self.city = sys.intern(city)
+        self.water_goal = water_goal
+        self.calorie_goal = calorie_goal
+        self.logged_water = logged_water
+        self.logged_calories = logged_calories
+        self.burned_calories = burned_calories
+        self.logged_activity = logged_activity
+        self.temperature = temperature
+        self.last_active_day = last_active_day
+        # Напоминания и вечерние итоги (вне тихих часов)
+        self.reminders = reminders
+        self.quiet_start = quiet_start
+        self.quiet_end = quiet_end
+
+    # Создание из непроверенных данных через схему UserProfileModel
+    @classmethod
+    def validate(cls, **fields) -> 'UserProfile':
+        return cls.from_model(UserProfileModel(**fields))
+
+    @classmethod
+    def from_model(cls, model: UserProfileModel) -> 'UserProfile':
+        data = model.model_dump()
+        data['last_active_day'] = date.fromisoformat(data.pop('last_active_date')).toordinal() - EPOCH_ORDINAL
+        return cls(**data)
+
+    @property
+    def last_active_date(self) -> str:
+        return date.fromordinal(self.last_active_day + EPOCH_ORDINAL).isoformat()
+
+    # Сериализация для хранилища: данные уже проверены, поэтому без pydantic
+    def to_json(self) -> str:
+        return _encoder.encode(_values(self))
+
+    @classmethod
+    def from_json(cls, data: str) -> 'UserProfile':
+        values = json.loads(data)
+        if isinstance(values, dict):
+            # Формат до перехода на компактные профили
+            return cls.from_model(UserProfileModel(**values))
+        return cls(*values)
+
+
+# Значения всех полей профиля одним кортежем
+_values = attrgetter(*UserProfile.FIELDS)
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
@@ -0,0 +1,236 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+from utils.history import local_epoch_day
+from utils.metrics import registry
+from utils.scheduler import TimerHeap
+from utils.sender import BROADCAST, OutboundSender
+
+# Виды рассылок
+REMINDER = 'reminder'
+DIGEST = 'digest'
+
+reminders_sent = registry.counter(
+    'reminders_sent_total', 'Отправленные напоминания и вечерние итоги', ('kind',)
+)
+
+
+# Ближайший момент (time.time()), когда в часовом поясе со смещением offset наступит hour:00
+def next_local_time(offset: int, hour: int, now: float) -> float:
+    local_midnight = (now + offset) // 86400 * 86400 - offset
+    when = local_midnight + hour * 3600
+    if when <= now:
+        when += 86400
+    return when
+
+
+def reminder_text(profile, behind_water: bool, behind_calories: bool) -> str:
+    lines = ["Напоминание:"]
+    if behind_water:
+        lines.append(f"  Выпито {profile.logged_water} из {profile.water_goal} мл, не забудьте выпить воды.")
+    if behind_calories:
+        lines.append(f"  Потреблено {profile.logged_calories:.0f} из {profile.calorie_goal} ккал.")
+    lines.append("Отключить напоминания: /reminders off")
+    return '\n'.join(lines)
+
+
+def digest_text(profile) -> str:
+    return (
+        "Итоги дня:\n" +
+        f"  Выпито: {profile.logged_water}/{profile.water_goal} мл;\n" +
+        f"  Потреблено: {profile.logged_calories:.0f}/{profile.calorie_goal} ккал;\n" +
+        f"  Потрачено: {profile.burned_calories} ккал;\n" +
+        f"  Активность: {profile.logged_activity} мин.\n" +
+        "Подробнее: /history"
+    )
+
+
+# Напоминания о воде и калориях, вечерние итоги и начало нового дня для всех
+# пользователей. Вместо задачи на каждого пользователя - куча таймеров
+# (часовой пояс, час): в наступивший час профили проверяются пачками, и
+# сообщения отставшим ставятся в очередь отправки с низким приоритетом.
+# Часовой пояс определяется по городу (смещение из ответа OpenWeatherMap);
+# id пользователей хранятся по поясам, и в наступивший час из хранилища
+# читаются только профили этого пояса.
+# Дневные счетчики относятся к местному дню пользователя: в местную полночь
+# (и перед любой рассылкой, если сброс еще не дошел) профили со счетчиками
+# за прошлый день передаются в on_day_start
+class ReminderScheduler:
+    def __init__(self, users, sender: OutboundSender, city_offset, reminder_hours=(11, 14, 17, 20),
+                 digest_hour: int = 21, batch_size: int = 10000, fetch_city=None,
+                 on_day_start=None, send_reminders: bool = True):
+        self.users = users
+        self.sender = sender
+        # city -> смещение от UTC в секундах или None, если неизвестно
+        self.city_offset = city_offset
+        # Корутина для получения данных о неизвестном городе (например, get_weather_async)
+        self.fetch_city = fetch_city
+        # Корутина сброса дня: список (профиль, номер местного дня)
+        self.on_day_start = on_day_start
+        # Без рассылок планировщик только начинает новый день
+        self.send_reminders = send_reminders
+        self.reminder_hours = tuple(reminder_hours)
+        self.digest_hour = digest_hour
+        self.batch_size = batch_size
+        # Для городов с неизвестным часовым поясом - пояс сервера
+        self.default_offset = time.localtime().tm_gmtoff
+        self._timers = TimerHeap()
+        self._offsets: set[int] = set()
+        # Пояс каждого пользователя и пользователи каждого пояса
+        self._user_offsets: dict[int, int] = {}
+        self._members: dict[int, set[int]] = {}
+        self.failed = 0
+
+    def offset_for(self, city: str) -> int:
+        offset = self.city_offset(city)
+        return self.default_offset if offset is None else offset
+
+    # Номер текущего дня по местному времени города
+    def local_today(self, city: str) -> int:
+        return local_epoch_day(time.time(), self.offset_for(city))
+
+    # Часы, в которые срабатывают таймеры пояса: рассылки и полночь
+    def _hours(self) -> set[int]:
+        hours = {0} if self.on_day_start is not None else set()
+        if self.send_reminders:
+            hours |= set(self.reminder_hours) | {self.digest_hour}
+        return hours
+
+    # Запланировать рассылки для часового пояса (если еще не запланированы)
+    def track_offset(self, offset: int):
+        if offset in self._offsets:
+            return
+        self._offsets.add(offset)
+        now = time.time()
+        for hour in self._hours():
+            self._timers.schedule(next_local_time(offset, hour, now), (offset, hour))
+
+    # Запомнить пояс пользователя (при создании профиля, смене города или
+    # уточнении смещения города); возвращает пояс
+    def track_user(self, user_id: int, city: str) -> int:
+        offset = self.offset_for(city)
+        previous = self._user_offsets.get(user_id)
+        if previous != offset:
+            if previous is not None:
+                self._members[previous].discard(user_id)
+            self._user_offsets[user_id] = offset
+            self._members.setdefault(offset, set()).add(user_id)
+            self.track_offset(offset)
+        return offset
+
+    async def run(self):
+        await self._discover()
+        await self._timers.run(self._fire)
+
+    # Часовые пояса всех пользователей при запуске (единственный полный обход)
+    async def _discover(self):
+        unknown: dict[str, list[int]] = {}
+        async for user_info in self.users.iter_all():
+            if self.city_offset(user_info.city) is None:
+                unknown.setdefault(user_info.city, []).append(user_info.id)
+            self.track_user(user_info.id, user_info.city)
+        if unknown and self.fetch_city is not None:
+            await asyncio.gather(*(self.fetch_city(city) for city in unknown), return_exceptions=True)
+            for city, user_ids in unknown.items():
+                for user_id in user_ids:
+                    self.track_user(user_id, city)
+
+    async def _fire(self, keys: list[tuple[int, int]]):
+        # В один момент в каждом поясе наступает не больше одного часа рассылки.
+        # Местный день считается для каждого пояса: в один момент в поясах,
+        # отличающихся на сутки, идут разные дни
+        now = time.time()
+        due = {offset: (hour, local_epoch_day(now, offset)) for offset, hour in keys}
+        # Состав поясов запоминается заранее: пользователь, перешедший в другой
+        # наступивший пояс, обрабатывается один раз
+        groups = [list(self._members.get(offset, ())) for offset in due]
+        try:
+            for user_ids in groups:
+                for start in range(0, len(user_ids), self.batch_size):
+                    batch = []
+                    for user_info in await self.users.get_many(user_ids[start:start + self.batch_size]):
+                        # Пояс мог смениться (новый город, стало известно смещение)
+                        offset = self.track_user(user_info.id, user_info.city)
+                        if offset in due:
+                            batch.append((user_info, *due[offset]))
+                    await self._process_batch(batch)
+        finally:
+            # Таймеры переносятся на следующие сутки и после ошибки: иначе в поясе
+            # перестанут начинаться дни
+            now = time.time()
+            for offset, hour in keys:
+                if self._members.get(offset) or offset == self.default_offset:
+                    self._timers.schedule(next_local_time(offset, hour, now), (offset, hour))
+                else:
+                    # Пользователей в этом поясе не осталось
+                    self._offsets.discard(offset)
+                    self._members.pop(offset, None)
+
+    # Пачка (профиль, час, местный день): сначала сброс счетчиков за прошлый
+    # день, чтобы напоминания и итоги считались по сегодняшним записям
+    async def _process_batch(self, batch: list):
+        if not batch:
+            return
+        if self.on_day_start is not None:
+            # Только вперед: день пользователя мог сдвинуться назад после
+            # уточнения часового пояса города
+            stale = [(profile, today) for profile, _, today in batch if today > profile.last_active_day]
+            if stale:
+                await self.on_day_start(stale)
+        if self.send_reminders:
+            await self._send_batch(batch)
+
+    # Проверка пачки профилей разом: кому и что отправить
+    async def _send_batch(self, batch: list):
+        import numpy as np
+        count = len(batch)
+        profiles = [profile for profile, _, _ in batch]
+        hour = np.fromiter((hour for _, hour, _ in batch), np.int64, count)
+        enabled = np.fromiter((profile.reminders for profile in profiles), bool, count)
+        quiet_start = np.fromiter((profile.quiet_start for profile in profiles), np.int64, count)
+        quiet_end = np.fromiter((profile.quiet_end for profile in profiles), np.int64, count)
+        water = np.fromiter((profile.logged_water for profile in profiles), np.float64, count)
+        water_goal = np.fromiter((profile.water_goal for profile in profiles), np.float64, count)
+        calories = np.fromiter((profile.logged_calories for profile in profiles), np.float64, count)
+        calorie_goal = np.fromiter((profile.calorie_goal for profile in profiles), np.float64, count)
+
+        # Тихие часы могут переходить через полночь (например, с 22 до 8)
+        in_quiet = np.where(
+            quiet_start > quiet_end,
+            (hour >= quiet_start) | (hour < quiet_end),
+            (hour >= quiet_start) & (hour < quiet_end)
+        )
+        # Доля дня вне тихих часов, прошедшая к этому часу
+        awake_hours = (quiet_start - quiet_end) % 24
+        awake_hours[awake_hours == 0] = 24
+        day_fraction = np.clip(((hour - quiet_end) % 24) / awake_hours, 0, 1)
+        behind_water = water < water_goal * day_fraction
+        behind_calories = calories < calorie_goal * day_fraction
+        is_digest = hour == self.digest_hour
+        # В полночь, если она не час рассылки, только начинается новый день
+        is_reminder = np.isin(hour, self.reminder_hours)
+        send = enabled & ~in_quiet & (is_digest | (is_reminder & (behind_water | behind_calories)))
+
+        queued = []
+        for index in np.flatnonzero(send).tolist():
+            profile = profiles[index]
+            if is_digest[index]:
+                kind, text = DIGEST, digest_text(profile)
+            else:
+                kind, text = REMINDER, reminder_text(profile, behind_water[index], behind_calories[index])
+            future = self.sender.enqueue(SendMessage(chat_id=profile.id, text=text), profile.id, BROADCAST)
+            queued.append((profile, kind, future))
+        # Следующая пачка проверяется, когда отправлена текущая: очередь не разрастается
+        results = await asyncio.gather(*(future for _, _, future in queued), return_exceptions=True)
+        for (profile, kind, _), result in zip(queued, results):
+            if isinstance(result, TelegramForbiddenError):
+                # Пользователь заблокировал бота
+                profile.reminders = False
+                await self.users.save(profile)
+            elif isinstance(result, BaseException):
+                self.failed += 1
+            else:
+                reminders_sent.inc(kind)
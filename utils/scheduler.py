@@ -0,0 +1,75 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+
+# Запуск и остановка фоновых задач вместе с ботом
+class BackgroundJobs:
+    def __init__(self):
+        self._tasks: set[asyncio.Task] = set()
+
+    def start(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+
+# Таймеры на куче с одним циклом ожидания: вместо отдельной задачи asyncio
+# на каждое событие хранится куча (время, ключ). Все наступившие события
+# передаются обработчику одной пачкой
+class TimerHeap:
+    def __init__(self):
+        self._heap: list[tuple[float, int, object]] = []
+        self._keys: set = set()
+        self._seq = itertools.count()
+        self._changed = asyncio.Event()
+
+    # Запланировать событие key на момент when (time.time()); повторный ключ игнорируется
+    def schedule(self, when: float, key) -> bool:
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        heapq.heappush(self._heap, (when, next(self._seq), key))
+        self._changed.set()
+        return True
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def _pop_due(self, now: float) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, key = heapq.heappop(self._heap)
+            self._keys.discard(key)
+            due.append(key)
+        return due
+
+    # Цикл ожидания: handler(список ключей) вызывается для наступивших событий
+    async def run(self, handler):
+        while True:
+            self._changed.clear()
+            delay = self._heap[0][0] - time.time() if self._heap else None
+            if delay is None or delay > 0:
+                try:
+                    # Новое событие может оказаться раньше ближайшего
+                    await asyncio.wait_for(self._changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = self._pop_due(time.time())
+            try:
+                await handler(due)
+            except Exception:
+                logging.exception("Ошибка при обработке запланированных событий")
@@ -0,0 +1,231 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, SendPhoto, TelegramMethod
+
+from utils.cache import LRUCache
+
+# Приоритеты: ответы пользователю обгоняют массовые рассылки
+INTERACTIVE = 0
+BROADCAST = 1
+LANES = {INTERACTIVE: 'interactive', BROADCAST: 'broadcast'}
+
+
+# Ведро токенов: rate токенов в секунду, не больше capacity накоплено
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Взять токен. Вернет 0, если токен взят, иначе сколько секунд ждать
+    def take(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+# Очередь исходящих сообщений с ограничением частоты отправки
+# (глобально и для каждого чата) и обработкой retry_after от Telegram.
+# В каждый чат отправляется не больше одного сообщения одновременно:
+# следующие ждут, пока предыдущее не отправлено (в том числе после retry_after),
+# поэтому порядок сообщений в чате сохраняется
+class OutboundSender:
+    def __init__(self, bot: Bot, global_rate: float = 30, chat_rate: float = 1,
+                 chat_burst: float = 3, workers: int = 16, max_retries: int = 3):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = LRUCache(100000)
+        # Чаты, для которых Telegram попросил подождать (retry_after)
+        self._blocked_until = LRUCache(100000)
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._slots = asyncio.Semaphore(workers)
+        self._task: asyncio.Task | None = None
+        self._send_tasks: set[asyncio.Task] = set()
+        self._delayed: dict[asyncio.TimerHandle, list] = {}
+        # Чаты, сообщение которых уже в очереди, ожидает или отправляется
+        self._active: set[int] = set()
+        # Следующие сообщения этих чатов (куча по приоритету и порядку постановки)
+        self._held: dict[int, list] = {}
+        self._unfinished = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.depth = {lane: 0 for lane in LANES}
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # Поставить метод Telegram в очередь без ожидания (для рассылок):
+    # результат или ошибка отправки будут в возвращенном future
+    def enqueue(self, method: TelegramMethod, chat_id: int, priority: int = INTERACTIVE) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._unfinished += 1
+        self._idle.clear()
+        item = [priority, next(self._seq), chat_id, method, future, 0]
+        if chat_id in self._active:
+            self.depth[priority] += 1
+            heapq.heappush(self._held.setdefault(chat_id, []), item)
+        else:
+            self._active.add(chat_id)
+            self._put(item)
+        return future
+
+    # Поставить метод Telegram в очередь и дождаться результата
+    async def send(self, method: TelegramMethod, chat_id: int, priority: int = INTERACTIVE):
+        return await self.enqueue(method, chat_id, priority)
+
+    async def send_message(self, chat_id: int, text: str, priority: int = INTERACTIVE, **kwargs):
+        return await self.send(SendMessage(chat_id=chat_id, text=text, **kwargs), chat_id, priority)
+
+    async def send_photo(self, chat_id: int, photo, priority: int = INTERACTIVE, **kwargs):
+        return await self.send(SendPhoto(chat_id=chat_id, photo=photo, **kwargs), chat_id, priority)
+
+    def _put(self, item: list):
+        self.depth[item[0]] += 1
+        self._queue.put_nowait(item)
+
+    def _put_later(self, delay: float, item: list):
+        def put():
+            self._delayed.pop(handle, None)
+            self._put(item)
+        handle = asyncio.get_running_loop().call_later(delay, put)
+        self._delayed[handle] = item
+
+    # Сообщение чата отправлено или отброшено: в очередь идет следующее
+    def _release(self, chat_id: int):
+        held = self._held.get(chat_id)
+        if not held:
+            self._active.discard(chat_id)
+            return
+        item = heapq.heappop(held)
+        if not held:
+            del self._held[chat_id]
+        self.depth[item[0]] -= 1
+        self._put(item)
+
+    def _finish(self, future: asyncio.Future, result=None, error: Exception | None = None):
+        if not future.done():
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._idle.set()
+
+    def _chat_delay(self, chat_id: int) -> float:
+        blocked_until = self._blocked_until.get(chat_id)
+        if blocked_until is not None:
+            delay = blocked_until - time.monotonic()
+            if delay > 0:
+                return delay
+            self._blocked_until.pop(chat_id)
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats.set(chat_id, bucket)
+        return bucket.take()
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            priority, _, chat_id, method, future, attempt = item
+            self.depth[priority] -= 1
+            if future.cancelled():
+                self._finish(future)
+                self._release(chat_id)
+                continue
+            # Лимит чата не должен задерживать сообщения в другие чаты
+            delay = self._chat_delay(chat_id)
+            if delay > 0:
+                self._put_later(delay, item)
+                continue
+            # Глобальный лимит общий для всех, поэтому просто ждем
+            delay = self._global.take()
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = self._global.take()
+            await self._slots.acquire()
+            task = asyncio.create_task(self._execute(item))
+            self._send_tasks.add(task)
+            task.add_done_callback(self._send_tasks.discard)
+
+    async def _execute(self, item: list):
+        priority, _, chat_id, method, future, attempt = item
+        try:
+            result = await self.bot(method)
+        except TelegramRetryAfter as e:
+            self._blocked_until.set(chat_id, time.monotonic() + e.retry_after)
+            if attempt < self.max_retries:
+                # Сообщение остается первым в своем чате и будет отправлено после паузы
+                self.retried += 1
+                item[5] = attempt + 1
+                self._put(item)
+            else:
+                self.failed += 1
+                self._finish(future, error=e)
+                self._release(chat_id)
+        except Exception as e:
+            self.failed += 1
+            self._finish(future, error=e)
+            self._release(chat_id)
+        else:
+            self.sent += 1
+            self._finish(future, result)
+            self._release(chat_id)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': {name: self.depth[lane] for lane, name in LANES.items()},
+            'delayed': len(self._delayed),
+            'in_flight': len(self._send_tasks),
+            'sent': self.sent,
+            'retried': self.retried,
+            'failed': self.failed
+        }
+
+    # Дождаться отправки уже поставленных сообщений и остановить очередь
+    async def close(self, timeout: float = 10):
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Не отправлено сообщений при остановке: %d", self._unfinished)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Неотправленные сообщения отменяются, чтобы не зависли ожидающие
+        for handle, item in self._delayed.items():
+            handle.cancel()
+            item[4].cancel()
+        self._delayed.clear()
+        while not self._queue.empty():
+            self._queue.get_nowait()[4].cancel()
+        for held in self._held.values():
+            for item in held:
+                item[4].cancel()
+        self._held.clear()
+        self._active.clear()
+        for task in self._send_tasks:
+            task.cancel()
+        await asyncio.gather(*self._send_tasks, return_exceptions=True)
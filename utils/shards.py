@@ -0,0 +1,73 @@
+import asyncio
+import os
+
+
+# id пользователя, от которого пришло обновление (0, если его нет)
+def update_user_id(update: dict) -> int:
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+        chat = value.get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+
+# Номер обработчика, которому принадлежит пользователь
+def shard_for(user_id: int, shards: int) -> int:
+    # Перемешивание битов, чтобы подряд идущие id не попадали в один шард
+    return ((user_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) % shards
+
+
+# Отдельный файл для каждого шарда: users.db -> users.shard1.db
+def shard_path(path: str, shard: int) -> str:
+    if not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}{ext}"
+
+
+# Выполнение задач с сохранением порядка для одного ключа:
+# задачи разных пользователей идут параллельно, одного - строго по очереди
+class KeyedSerializer:
+    def __init__(self, max_concurrency: int = 100):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Последняя задача каждого ключа
+        self._tails: dict[int, asyncio.Task] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def _chain(self, previous: asyncio.Task | None, coro):
+        try:
+            if previous is not None:
+                await asyncio.wait([previous])
+            await coro
+        finally:
+            self._semaphore.release()
+
+    # Ждет свободного места, если задач уже слишком много
+    async def submit(self, key: int, coro) -> asyncio.Task:
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._chain(self._tails.get(key), coro))
+        self._tails[key] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda done: self._done(key, done))
+        return task
+
+    def _done(self, key: int, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._tails.get(key) is task:
+            del self._tails[key]
+
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    async def drain(self, timeout: float | None = None):
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import sqlite3
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.profiles import UserProfile
+
+# Сколько id передавать в одном запросе IN (...)
+SELECT_CHUNK = 500
+
+
+# Общий интерфейс хранилища профилей пользователей
+class UserStorage:
+    async def start(self):
+        pass
+
+    async def get(self, user_id: int) -> UserProfile | None:
+        raise NotImplementedError
+
+    async def save(self, profile: UserProfile):
+        raise NotImplementedError
+
+    # Профили с заданными id (отсутствующие пропускаются)
+    async def get_many(self, user_ids: list[int]) -> list[UserProfile]:
+        profiles = []
+        for user_id in user_ids:
+            profile = await self.get(user_id)
+            if profile is not None:
+                profiles.append(profile)
+        return profiles
+
+    # Обход всех профилей (например, для ежедневного сброса)
+    async def iter_all(self, batch_size: int = 1000):
+        raise NotImplementedError
+        yield
+
+    # Число профилей, загруженных в память
+    def cached_count(self) -> int:
+        raise NotImplementedError
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+# Хранение профилей в памяти процесса (данные теряются при перезапуске)
+class MemoryUserStorage(UserStorage):
+    def __init__(self):
+        self._users: dict[int, UserProfile] = {}
+
+    async def get(self, user_id: int):
+        return self._users.get(user_id)
+
+    async def save(self, profile: UserProfile):
+        self._users[profile.id] = profile
+
+    async def iter_all(self, batch_size: int = 1000):
+        for profile in list(self._users.values()):
+            yield profile
+
+    def cached_count(self) -> int:
+        return len(self._users)
+
+
+# Хранение профилей в SQLite (WAL) с отложенной пакетной записью
+# и ограниченным набором "горячих" профилей в памяти
+class SQLiteUserStorage(UserStorage):
+    def __init__(self, path: str, model: type[UserProfile], cache_size: int = 10000,
+                 flush_interval: float = 5.0, flush_batch: int = 500):
+        self.path = path
+        self.model = model
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        # Все обращения к соединению идут из одного потока
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='user-storage')
+        self._conn: sqlite3.Connection | None = None
+        self._hot: OrderedDict[int, UserProfile] = OrderedDict()
+        # Измененные, но еще не записанные профили
+        self._dirty: dict[int, UserProfile] = {}
+        # Все экземпляры, которые еще где-то используются (например, обходом
+        # iter_all после вытеснения из _hot): у пользователя всегда один экземпляр,
+        # и изменения одного обработчика не затираются копией другого
+        self._live: weakref.WeakValueDictionary[int, UserProfile] = weakref.WeakValueDictionary()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self._pending_flush: asyncio.Task | None = None
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        conn.commit()
+        self._conn = conn
+
+    def _select_one(self, user_id: int):
+        row = self._conn.execute("SELECT data FROM users WHERE id = ?", (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def _select_many(self, user_ids: list[int]):
+        rows = []
+        for start in range(0, len(user_ids), SELECT_CHUNK):
+            chunk = user_ids[start:start + SELECT_CHUNK]
+            rows += self._conn.execute(
+                f"SELECT id, data FROM users WHERE id IN ({', '.join('?' * len(chunk))})",
+                chunk
+            ).fetchall()
+        return rows
+
+    def _select_batch(self, after_id: int, limit: int):
+        return self._conn.execute(
+            "SELECT id, data FROM users WHERE id > ? ORDER BY id LIMIT ?",
+            (after_id, limit)
+        ).fetchall()
+
+    def _write(self, rows: list[tuple[int, str]]):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO users (id, data) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data",
+                rows
+            )
+
+    def _close_conn(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def start(self):
+        await self._run(self._connect)
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Ошибка при записи профилей в базу")
+
+    def _loaded(self, user_id: int) -> UserProfile | None:
+        return self._dirty.get(user_id) or self._hot.get(user_id) or self._live.get(user_id)
+
+    # Экземпляр из базы, если профиль еще не загружен
+    def _load(self, user_id: int, data: str) -> UserProfile:
+        profile = self._loaded(user_id)
+        if profile is None:
+            profile = self.model.from_json(data)
+            self._live[user_id] = profile
+        return profile
+
+    def _remember(self, profile: UserProfile):
+        self._live[profile.id] = profile
+        self._hot[profile.id] = profile
+        self._hot.move_to_end(profile.id)
+        # Вытесненные измененные профили остаются в _dirty до записи
+        while len(self._hot) > self.cache_size:
+            self._hot.popitem(last=False)
+
+    async def get(self, user_id: int):
+        profile = self._loaded(user_id)
+        if profile is not None:
+            self._remember(profile)
+            return profile
+        data = await self._run(self._select_one, user_id)
+        if data is None:
+            return None
+        # Пока шло чтение, профиль мог загрузить другой обработчик
+        profile = self._load(user_id, data)
+        self._remember(profile)
+        return profile
+
+    async def save(self, profile: UserProfile):
+        self._dirty[profile.id] = profile
+        self._remember(profile)
+        # Не ждем периодической записи, если накопилось много изменений
+        if len(self._dirty) >= self.flush_batch and \
+                (self._pending_flush is None or self._pending_flush.done()):
+            self._pending_flush = asyncio.create_task(self.flush())
+
+    async def get_many(self, user_ids: list[int]) -> list[UserProfile]:
+        profiles = []
+        missing = []
+        for user_id in user_ids:
+            profile = self._loaded(user_id)
+            if profile is None:
+                missing.append(user_id)
+            else:
+                profiles.append(profile)
+        if missing:
+            rows = await self._run(self._select_many, missing)
+            # Как и iter_all, не вытесняет горячие профили
+            profiles += [self._load(user_id, data) for user_id, data in rows]
+        return profiles
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, {}
+            # Сериализация в потоке цикла событий, чтобы получить согласованный снимок
+            rows = [(user_id, profile.to_json()) for user_id, profile in batch.items()]
+            try:
+                await self._run(self._write, rows)
+            except Exception:
+                # Вернуть в буфер все, что не было изменено заново
+                for user_id, profile in batch.items():
+                    self._dirty.setdefault(user_id, profile)
+                raise
+
+    async def iter_all(self, batch_size: int = 1000):
+        await self.flush()
+        last_id = -1 << 63
+        while True:
+            rows = await self._run(self._select_batch, last_id, batch_size)
+            if not rows:
+                break
+            for user_id, data in rows:
+                # Обход не вытесняет горячие профили, но отдает тот же экземпляр, что и get()
+                yield self._load(user_id, data)
+            last_id = rows[-1][0]
+
+    def cached_count(self) -> int:
+        return len(self._hot) + sum(1 for user_id in self._dirty if user_id not in self._hot)
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+            self._flush_task = None
+        await self.flush()
+        await self._run(self._close_conn)
+        self._executor.shutdown(wait=True)
+
+
+def create_user_storage(kind: str, model: type[UserProfile], path: str, cache_size: int,
+                        flush_interval: float, flush_batch: int) -> UserStorage:
+    if kind == 'sqlite':
+        return SQLiteUserStorage(path, model, cache_size, flush_interval, flush_batch)
+    if kind == 'memory':
+        return MemoryUserStorage()
+    raise ValueError(f"Неизвестный тип хранилища: {kind}")
@@ -1,45 +1,194 @@
+import asyncio
 import io
-import matplotlib.pyplot as plt
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 
+from utils.cache import LRUCache
+from utils.metrics import chart_render_duration
 
-def get_water_visualization(logged_water, water_goal, logged_calories, calorie_goal, logged_activity, activity_goal):
-    plt.figure(figsize=(15, 5))
-    # Вода
-    plt.subplot(1, 3, 1)
-    plt.bar(
-        ['Выпито', 'Цель выпить'],
+# Подписи, цвета и оформление панелей графика
+PANELS = [
+    (['Выпито', 'Цель выпить'], ['blue', 'green'],
+     'Потребление воды', 'Объем (мл)', 'Вода', 100),
+    (['Потреблено', 'Цель по калориям'], ['red', 'green'],
+     'Потребление калорий', 'Потребление (калории)', 'Калории', 100),
+    (['Активность', 'Цель активности'], ['orange', 'green'],
+     'Активность за день', 'Активность (минуты)', 'Активность', 10),
+]
+
+
+# Построение одной панели графика
+def _draw_bars(ax, labels, values, colors, title, ylabel, xlabel, margin):
+    ax.bar(labels, values, color=colors)
+    ax.set_title(title)
+    ax.set_ylabel(ylabel)
+    ax.set_xlabel(xlabel)
+    ax.set_ylim(0, max(values) + margin)
+
+
+# matplotlib загружается при первом рендере (или заранее, см. ChartRenderer.preload),
+# а не при импорте модуля: это заметная часть времени запуска бота
+def _new_figure():
+    from matplotlib.figure import Figure
+    return Figure(figsize=(15, 5))
+
+
+# Ключ графика: кортеж из шести входных значений
+def chart_key(logged_water, water_goal, logged_calories, calorie_goal,
+              logged_activity, activity_goal) -> tuple:
+    return (logged_water, water_goal, logged_calories, calorie_goal, logged_activity, activity_goal)
+
+
+# Рендер графика в PNG. Используется объектный API Figure/Agg без глобального
+# состояния pyplot, поэтому функцию можно вызывать из потоков и процессов
+def render_water_visualization(logged_water, water_goal, logged_calories, calorie_goal,
+                               logged_activity, activity_goal) -> bytes:
+    fig = _new_figure()
+    values = [
         [logged_water, water_goal],
-        color=['blue', 'green']
-    )
-    plt.title('Потребление воды')
-    plt.ylabel('Объем (мл)')
-    plt.xlabel('Вода')
-    plt.ylim(0, max(water_goal, logged_water) + 100)
-    # Калории
-    plt.subplot(1, 3, 2)
-    plt.bar(
-        ['Потреблено', 'Цель по калориям'],
         [logged_calories, calorie_goal],
-        color=['red', 'green']
-    )
-    plt.title('Потребление калорий')
-    plt.ylabel('Потребление (калории)')
-    plt.xlabel('Калории')
-    plt.ylim(0, max(calorie_goal, logged_calories) + 100)
-    # Активность
-    plt.subplot(1, 3, 3)
-    plt.bar(
-        ['Активность', 'Цель активности'],
-        [logged_activity, activity_goal],
-        color=['orange', 'green']
-    )
-    plt.title('Активность за день')
-    plt.ylabel('Активность (минуты)')
-    plt.xlabel('Активность')
-    plt.ylim(0, max(activity_goal, logged_activity) + 10)
-    plt.tight_layout()
+        [logged_activity, activity_goal]
+    ]
+    for i, (labels, colors, title, ylabel, xlabel, margin) in enumerate(PANELS):
+        ax = fig.add_subplot(1, 3, i + 1)
+        _draw_bars(ax, labels, values[i], colors, title, ylabel, xlabel, margin)
+    fig.tight_layout()
     buf = io.BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close()
-    return buf
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+# Заготовка графика для быстрого режима (одна на процесс)
+_template = None
+_template_lock = threading.Lock()
+
+
+def _build_template():
+    fig = _new_figure()
+    panels = []
+    for i, (labels, colors, title, ylabel, xlabel, margin) in enumerate(PANELS):
+        ax = fig.add_subplot(1, 3, i + 1)
+        # Разметка рассчитывается по крупным значениям, чтобы подписи осей
+        # не обрезались при обновлении высоты столбцов
+        _draw_bars(ax, labels, [10000, 10000], colors, title, ylabel, xlabel, margin)
+        panels.append((ax, list(ax.patches), margin))
+    fig.tight_layout()
+    return fig, panels
+
+
+# Быстрый рендер: переиспользует готовую фигуру и меняет только высоту столбцов
+# и пределы осей
+def render_water_visualization_fast(logged_water, water_goal, logged_calories, calorie_goal,
+                                    logged_activity, activity_goal) -> bytes:
+    global _template
+    values = [
+        [logged_water, water_goal],
+        [logged_calories, calorie_goal],
+        [logged_activity, activity_goal]
+    ]
+    with _template_lock:
+        if _template is None:
+            _template = _build_template()
+        fig, panels = _template
+        for (ax, bars, margin), panel_values in zip(panels, values):
+            for bar, value in zip(bars, panel_values):
+                bar.set_height(value)
+            ax.set_ylim(0, max(panel_values) + margin)
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+# Пробный рендер: загружает matplotlib, шрифты и бэкенд Agg
+def _warm_up(render):
+    try:
+        render(0, 1, 0, 1, 0, 1)
+    except Exception:
+        logging.exception("Ошибка при предварительной загрузке matplotlib")
+
+
+# Очередь рендера переполнена
+class RendererBusy(Exception):
+    pass
+
+
+# Пул для рендера графиков вне потока цикла событий
+class ChartRenderer:
+    def __init__(self, workers: int = 2, kind: str = 'process', queue_size: int = 16,
+                 fast: bool = False, cache_size: int = 1000, cache_bytes: int = 64 * 1024 * 1024):
+        self.workers = workers
+        self.kind = kind
+        # Сколько графиков может одновременно рендериться или ждать в очереди
+        self.queue_size = queue_size
+        self._render = render_water_visualization_fast if fast else render_water_visualization
+        # Готовые PNG по ключу chart_key
+        self.cache = LRUCache(cache_size, max_bytes=cache_bytes)
+        self._executor: Executor | None = None
+        self._pending = 0
+        self.rendered = 0
+        self.rejected = 0
+
+    def start(self, preload: bool = False):
+        if self._executor is not None:
+            return
+        if self.kind == 'process':
+            # spawn: рабочие процессы не наследуют потоки и сокеты бота
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                # Каждый рабочий процесс загружает matplotlib сразу после запуска
+                initializer=_warm_up if preload else None,
+                initargs=(self._render,) if preload else ()
+            )
+        elif self.kind == 'thread':
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix='chart-render'
+            )
+        else:
+            raise ValueError(f"Неизвестный тип пула: {self.kind}")
+
+    # Фоновая загрузка matplotlib, чтобы первый запрос графика не ждал импорта.
+    # Рабочие процессы и потоки создаются при первой задаче, поэтому отправляется пробная
+    def preload(self):
+        self.start(preload=True)
+        if self.kind == 'process':
+            self._executor.submit(int)
+        else:
+            self._executor.submit(_warm_up, self._render)
+
+    async def render(self, *values) -> bytes:
+        key = chart_key(*values)
+        png = self.cache.get(key)
+        if png is not None:
+            return png
+        if self._pending >= self.queue_size:
+            self.rejected += 1
+            raise RendererBusy
+        self.start()
+        self._pending += 1
+        try:
+            with chart_render_duration.time():
+                png = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self._render, *values
+                )
+        finally:
+            self._pending -= 1
+        self.rendered += 1
+        self.cache.set(key, png)
+        return png
+
+    def stats(self) -> dict:
+        return {
+            'pending': self._pending,
+            'rendered': self.rendered,
+            'rejected': self.rejected,
+            'cache': self.cache.stats()
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+from typing import Any
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+# Обработчик вебхука с ограничением числа одновременно обрабатываемых
+# обновлений и плавным завершением (дожидается обработки уже принятых).
+# Сессию бота обработчик не закрывает: после него при остановке диспетчера
+# еще отправляются сообщения из очереди, сессия закрывается в run_webhook
+class LimitedRequestHandler(SimpleRequestHandler):
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str,
+                 max_concurrency: int = 100, max_pending: int = 1000,
+                 drain_timeout: float = 30, **data: Any):
+        super().__init__(
+            dispatcher=dispatcher,
+            bot=bot,
+            handle_in_background=True,
+            secret_token=secret_token,
+            **data
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_pending = max_pending
+        self.drain_timeout = drain_timeout
+        self._closing = False
+
+    async def _background_feed_update(self, bot: Bot, update: dict[str, Any]) -> None:
+        async with self._semaphore:
+            await super()._background_feed_update(bot, update)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        # При остановке или переполнении отвечаем ошибкой: Telegram повторит
+        # доставку позже (возможно, на другой экземпляр)
+        if self._closing or len(self._background_feed_update_tasks) >= self.max_pending:
+            return web.Response(status=503)
+        return await super().handle(request)
+
+    __call__ = handle
+
+    async def close(self) -> None:
+        self._closing = True
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            logging.info("Ожидание обработки %d обновлений перед остановкой", len(tasks))
+            _, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+# Запуск бота в режиме вебхука на aiohttp-сервере
+def run_webhook(dp: Dispatcher, bot: Bot, base_url: str, path: str, host: str, port: int,
+                secret_token: str, max_concurrency: int, max_pending: int,
+                max_connections: int, drain_timeout: float):
+    if not base_url or not secret_token:
+        raise ValueError("Для режима вебхука нужны WEBHOOK_URL и WEBHOOK_SECRET")
+
+    async def on_startup(app: web.Application):
+        await bot.set_webhook(
+            base_url.rstrip('/') + path,
+            secret_token=secret_token,
+            max_connections=max_connections
+        )
+
+    # Последний обработчик остановки диспетчера: до него бот еще отправляет сообщения
+    async def close_bot_session():
+        await bot.session.close()
+
+    app = web.Application()
+    handler = LimitedRequestHandler(
+        dp,
+        bot,
+        secret_token,
+        max_concurrency=max_concurrency,
+        max_pending=max_pending,
+        drain_timeout=drain_timeout
+    )
+    handler.register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    dp.shutdown.register(close_bot_session)
+    app.on_startup.append(on_startup)
+    web.run_app(app, host=host, port=port, shutdown_timeout=drain_timeout)